@@ -0,0 +1,52 @@
+from __future__ import print_function
+import argparse
+import json
+import sys
+import scaling
+import synthetic
+
+
+def sizes(text):
+    return map(lambda size: tuple(map(int, size.split('x'))),
+               text.split(','))
+
+
+def numbers(text):
+    return map(int, text.split(','))
+
+
+parser = argparse.ArgumentParser(
+    description='Scaling benchmark of the CPU strategy.')
+parser.add_argument('--data', default=scaling.DATA)
+parser.add_argument('--static', default='static.nc')
+parser.add_argument('--tile-sizes', type=sizes, default=scaling.TILE_SIZES,
+                    help='comma separated YxX tile sizes (e.g. 5x10,20x40)')
+parser.add_argument('--images', type=numbers, default=scaling.IMAGES)
+parser.add_argument('--workers', type=numbers, default=scaling.WORKERS)
+parser.add_argument('--output', help='save the results as a baseline')
+parser.add_argument('--compare', help='baseline to compare the results to')
+parser.add_argument('--tolerance', type=float, default=0.1)
+parser.add_argument('--timeout', type=int,
+                    help='seconds before a configuration is aborted')
+parser.add_argument('--generate', metavar='PATH',
+                    help='benchmark a synthetic scene written into PATH')
+parser.add_argument('--shape', type=lambda text: sizes(text)[0],
+                    default=synthetic.FULL_DISK,
+                    help='YxX pixels of the synthetic scene')
+parser.add_argument('--days', type=int, default=30,
+                    help='days of the synthetic scene')
+parser.add_argument('--interval', type=int, default=30,
+                    help='minutes between the synthetic images')
+args = parser.parse_args()
+if args.generate:
+    synthetic.generate(args.generate, args.shape, days=args.days,
+                       interval=args.interval)
+    args.data = '{:s}/goes13.*.BAND_01.nc'.format(args.generate)
+    args.static = '{:s}/static.nc'.format(args.generate)
+current = scaling.run(scaling.configurations(args.tile_sizes, args.images,
+                                             args.workers),
+                      args.data, args.static, args.output, args.timeout)
+if args.compare:
+    with open(args.compare) as f:
+        regressions = scaling.compare(json.load(f), current, args.tolerance)
+    sys.exit(1 if regressions else 0)
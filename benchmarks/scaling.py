@@ -0,0 +1,160 @@
+from __future__ import print_function
+from models import JobDescription, TiledJobDescription
+from multiprocessing import Process, Queue
+from Queue import Empty
+from datetime import datetime
+import subprocess
+import time
+import resource
+import socket
+import json
+import glob
+
+
+DATA = 'data/goes13.*.BAND_01.nc'
+TILE_SIZES = [(5, 10), (10, 20), (20, 40)]
+IMAGES = [12, 24, 45]
+WORKERS = [1, 2, 4]
+
+
+def peak_rss():
+    # The ru_maxrss is expressed in kilobytes on linux.
+    usage = lambda who: resource.getrusage(who).ru_maxrss * 1024
+    return max(usage(resource.RUSAGE_SELF),
+               usage(resource.RUSAGE_CHILDREN))
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always',
+                                        '--dirty']).strip()
+    except Exception:
+        return 'unknown'
+
+
+def configurations(tile_sizes=TILE_SIZES, images=IMAGES, workers=WORKERS):
+    return [{'tile_size': list(size), 'images': n, 'workers': w}
+            for size in tile_sizes for n in images for w in workers]
+
+
+def execute(configuration, data, static_file, queue):
+    try:
+        queue.put(estimate(configuration, data, static_file))
+    except Exception, e:
+        queue.put({'error': '{:s}: {:s}'.format(type(e).__name__,
+                                                    str(e))})
+
+
+def estimate(configuration, data, static_file):
+    (y, x), n = configuration['tile_size'], configuration['images']
+    files = JobDescription.filter_data(sorted(glob.glob(data)))[-n:]
+    config = {
+        'data': files,
+        'static_file': static_file,
+        'tile_cut': {'yc': [0, y], 'xc': [0, x]},
+        'hard': 'cpu',
+    }
+    if configuration['workers'] > 1:
+        # Each worker estimates a band of rows of the tile.
+        rows = max(y / configuration['workers'], 1)
+        job = TiledJobDescription(tile_shape={'yc': rows, 'xc': x},
+                                  processes=configuration['workers'],
+                                  **config)
+    else:
+        job = JobDescription(**config)
+    begin = datetime.now()
+    job.run()
+    elapsed = (datetime.now() - begin).total_seconds()
+    images = len(job.config['filenames'])
+    return {'images': images,
+            'elapsed': elapsed,
+            'throughput': y * x * images / elapsed,
+            'peak_rss': peak_rss()}
+
+
+def wait(process, queue, timeout=None):
+    begin = time.time()
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            pass
+        if not process.is_alive():
+            # The result could arrive after the last wait.
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                return {'error': 'the process exited with code {:d}'.format(
+                    process.exitcode)}
+        if timeout and time.time() - begin > timeout:
+            process.terminate()
+            return {'error': 'timeout after {:d} seconds'.format(timeout)}
+
+
+def measure(configuration, data=DATA, static_file='static.nc',
+            timeout=None):
+    """
+    Run a configuration in a new process, so the peak of resident memory
+    belongs to it, and return its measurements. If the process fails (or
+    it runs for more than timeout seconds) the result has its error instead.
+    """
+    queue = Queue()
+    process = Process(target=execute,
+                      args=(configuration, data, static_file, queue))
+    process.start()
+    result = wait(process, queue, timeout)
+    process.join()
+    return dict(configuration, **result)
+
+
+def run(configurations, data=DATA, static_file='static.nc', output=None,
+        timeout=None):
+    results = []
+    for configuration in configurations:
+        result = measure(configuration, data, static_file, timeout)
+        if 'error' in result:
+            print('tile {tile_size}, {images} images, {workers} workers: '
+                  'failed, {error}'.format(**result))
+        else:
+            print('tile {tile_size}, {images} images, {workers} workers: '
+                  '{elapsed:.2f}s, {throughput:.0f} pixel-images/s, peak '
+                  'rss {peak_rss:d} bytes'.format(**result))
+        results.append(result)
+    baseline = {
+        'version': version(),
+        'machine': socket.gethostname(),
+        'date': datetime.utcnow().isoformat(),
+        'results': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+    return baseline
+
+
+def key(result):
+    return (tuple(result['tile_size']), result['images'], result['workers'])
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    Return the results of current whose throughput is more than tolerance
+    (as a fraction) below the same configuration of the baseline, or that
+    failed when the baseline didn't.
+    """
+    previous = dict(map(lambda r: (key(r), r), baseline['results']))
+    regressions = []
+    for result in current['results']:
+        reference = previous.get(key(result))
+        if reference is None or 'error' in reference:
+            continue
+        if 'error' in result:
+            regressions.append(result)
+            continue
+        ratio = result['throughput'] / reference['throughput']
+        print('tile {tile_size}, {images} images, {workers} workers: '
+              '{ratio:.2f}x ({version})'.format(
+                  ratio=ratio, version=baseline['version'], **result))
+        if ratio < 1 - tolerance:
+            regressions.append(result)
+    return regressions
@@ -0,0 +1,144 @@
+from __future__ import print_function
+from netcdf import netcdf as nc
+from models.cache import StaticCache
+from models.heliosat import SAT_LON
+from datetime import datetime, timedelta
+import numpy as np
+import calendar
+import os
+
+
+FULL_DISK = (2260, 4360)
+# Calibration coefficients of the GOES-13 visible channel (as the samples).
+COUNTS_SHIFT = 32.
+SPACE_MEASUREMENT = 29.
+PRELAUNCH_0 = 0.6118
+PRELAUNCH_1 = 0.00116
+POSTLAUNCH = 1.314
+GOES_OBSERVED_ALBEDO_CALIBRATION = 1.89544 * (10 ** (-3))
+
+
+def smooth(coarse, shape, offset=0., width=None):
+    """
+    Bilinear interpolation of width columns (all by default) of a coarse
+    random field to shape, displaced offset columns along the xc axis.
+    """
+    cy, cx = coarse.shape
+    width = width or cx
+    y = np.linspace(0, cy - 1, shape[0])
+    x = np.linspace(0, width - 1, shape[1]) + offset
+    y0 = np.minimum(y.astype(int), cy - 2)
+    x0 = np.minimum(x.astype(int), cx - 2)
+    wy = (y - y0)[:, np.newaxis]
+    wx = (x - x0)[np.newaxis, :]
+    row = lambda y: coarse[y][:, x0] * (1 - wx) + coarse[y][:, x0 + 1] * wx
+    top, bottom = row(y0), row(y0 + 1)
+    return (top * (1 - wy) + bottom * wy).astype(np.float32)
+
+
+def grid(shape, lat=(-56., -21.), lon=(-76., -53.)):
+    lats = np.linspace(lat[1], lat[0], shape[0]).astype(np.float32)
+    lons = np.linspace(lon[0], lon[1], shape[1]).astype(np.float32)
+    return np.meshgrid(lats, lons, indexing='ij')
+
+
+def cos_zenith(dt, lat, lon):
+    day = dt.timetuple().tm_yday
+    declination = np.deg2rad(23.45) * np.sin(2 * np.pi * (284 + day) / 365.)
+    hour = dt.hour + dt.minute / 60. + dt.second / 3600.
+    hourlyangle = np.deg2rad(15. * (hour - 12.) + lon)
+    lat = np.deg2rad(lat)
+    return np.maximum(np.sin(lat) * np.sin(declination) +
+                      np.cos(lat) * np.cos(declination) *
+                      np.cos(hourlyangle), 0.)
+
+
+def counts(albedo, cos_z):
+    radiance = albedo * cos_z / GOES_OBSERVED_ALBEDO_CALIBRATION
+    raw = (radiance / (POSTLAUNCH * PRELAUNCH_0) +
+           SPACE_MEASUREMENT) * COUNTS_SHIFT
+    raw = np.round(raw / COUNTS_SHIFT) * COUNTS_SHIFT
+    return np.minimum(raw, 1023 * COUNTS_SHIFT).astype(np.float32)
+
+
+def get_filename(path, dt):
+    return '{:s}/goes13.{:s}.BAND_01.nc'.format(
+        path, dt.strftime('%Y.%j.%H%M%S'))
+
+
+def write_image(filename, dt, lat, lon, data):
+    with nc.loader(filename) as root:
+        nc.getdim(root, 'xc', lat.shape[1])
+        nc.getdim(root, 'yc', lat.shape[0])
+        nc.getdim(root, 'time', 1)
+        nc.getdim(root, 'xc_1', 1)
+        nc.getdim(root, 'yc_1', 1)
+        nc.getvar(root, 'time', 'i4', ('time',))[:] = \
+            calendar.timegm(dt.timetuple())
+        nc.getvar(root, 'lat', 'f4', ('yc', 'xc'))[:] = lat
+        nc.getvar(root, 'lon', 'f4', ('yc', 'xc'))[:] = lon
+        nc.getvar(root, 'data', 'f4', ('time', 'yc', 'xc'))[:] = data
+        coefficients = [('counts_shift', COUNTS_SHIFT),
+                        ('space_measurement', SPACE_MEASUREMENT),
+                        ('prelaunch_0', PRELAUNCH_0),
+                        ('prelaunch_1', PRELAUNCH_1),
+                        ('postlaunch', POSTLAUNCH)]
+        for name, value in coefficients:
+            nc.getvar(root, name, 'f4', ('time', 'yc_1', 'xc_1'))[:] = value
+
+
+def write_static(filename, lat, lon, random):
+    """
+    Write a static file with a synthetic DEM and Linke turbidity and the
+    satellital geometry of the grid, without downloading the real maps.
+    """
+    with nc.loader(filename) as root:
+        nc.getdim(root, 'xc', lat.shape[1])
+        nc.getdim(root, 'yc', lat.shape[0])
+        lat_var = nc.getvar(root, 'lat', 'f4', ('yc', 'xc'))
+        lat_var[:] = lat
+        lon_var = nc.getvar(root, 'lon', 'f4', ('yc', 'xc'))
+        lon_var[:] = lon
+        nc.getvar(root, 'dem', 'f4', ('yc', 'xc'))[:] = (
+            3000. * smooth(random.rand(12, 24), lat.shape) ** 2)
+        nc.getdim(root, 'months', 12)
+        turbidity = 2. + 2. * smooth(random.rand(12, 24), lat.shape)
+        seasons = 1. + 0.2 * np.cos(2 * np.pi * np.arange(12) / 12.)
+        nc.getvar(root, 'linke', 'f4', ('months', 'yc', 'xc'))[:] = (
+            seasons[:, np.newaxis, np.newaxis] * turbidity)
+        StaticCache.project_satellital(root, lat_var, lon_var, SAT_LON)
+
+
+def generate(path, shape=FULL_DISK, begin=datetime(2015, 1, 1), days=30,
+             interval=30, first_hour=9, last_hour=23, seed=0):
+    """
+    Write a synthetic scene of shape pixels into path: one image every
+    interval minutes between first_hour and last_hour (UTC) of each day,
+    with clouds drifting over a ground of smooth albedo, and its static
+    file (static.nc). Return the filenames of the images.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    random = np.random.RandomState(seed)
+    lat, lon = grid(shape)
+    write_static('{:s}/static.nc'.format(path), lat, lon, random)
+    ground = 0.08 + 0.12 * smooth(random.rand(20, 40), shape)
+    slots = ((last_hour - first_hour) * 60) / interval + 1
+    # The clouds drift a quarter of a coarse cell by image.
+    clouds = random.rand(16, 32 + days * slots / 4 + 2)
+    filenames = []
+    for day in range(days):
+        for slot in range(slots):
+            dt = (begin + timedelta(days=day, hours=first_hour,
+                                    minutes=slot * interval))
+            drift = (day * slots + slot) / 4.
+            cover = np.clip((smooth(clouds, shape, drift, 32) - 0.55) * 4.,
+                            0., 1.)
+            albedo = ground * (1 - cover) + 0.7 * cover
+            filename = get_filename(path, dt)
+            write_image(filename, dt, lat, lon,
+                        counts(albedo, cos_zenith(dt, lat, lon))[np.newaxis])
+            filenames.append(filename)
+    print('{:d} images of {:d}x{:d} pixels written into {:s}.'.format(
+        len(filenames), shape[0], shape[1], path))
+    return filenames
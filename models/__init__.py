@@ -1 +1 @@
-from runner import JobDescription
+from runner import JobDescription, TiledJobDescription
@@ -1,61 +1,172 @@
 from datetime import datetime
+from collections import OrderedDict
 import numpy as np
 from netcdf import netcdf as nc
+import netCDF4
 import logging
 from linketurbidity import instrument as linke
 from noaadem import instrument as dem
-from helpers import short
+from helpers import short, netcdf_lock
+import scheduler
+from writer import ProductWriter
+from contextlib import closing
 import os
+import glob
+import hashlib
+import shutil
+import weakref
+
+
+class LazyVariable(object):
+    """
+    Proxy of a variable of a Cache. Slicing it only reads the requested
+    hyperslab and using it as an array materializes the whole variable
+    inside the memory budget of the Cache.
+    """
+
+    __array_priority__ = 10.0
+
+    def __init__(self, cache, name, var):
+        self.cache = cache
+        self.name = name
+        self.var = var
+
+    @property
+    def shape(self):
+        return self.var.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        array = self.cache.materialize(self.name)
+        return array if dtype is None else array.astype(dtype)
+
+    def __getitem__(self, key):
+        array = self.cache.materialized(self.name)
+        if array is not None:
+            return array[key]
+        with netcdf_lock:
+            return self.var[key]
+
+    def __setitem__(self, key, value):
+        with netcdf_lock:
+            self.var[key] = value
+        array = self.cache.materialized(self.name)
+        if array is not None:
+            array[key] = value
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(np.asarray(self), name)
+
+
+def delegate(cls, operators):
+    def operator(name):
+        method = lambda self, *args: getattr(np.asarray(self), name)(*args)
+        method.__name__ = name
+        return method
+    for name in map(lambda o: '__{:s}__'.format(o), operators):
+        setattr(cls, name, operator(name))
+
+
+delegate(LazyVariable, ['add', 'sub', 'mul', 'div', 'truediv', 'floordiv',
+                        'mod', 'pow', 'radd', 'rsub', 'rmul', 'rdiv',
+                        'rtruediv', 'rfloordiv', 'rmod', 'rpow', 'neg',
+                        'pos', 'abs', 'lt', 'le', 'eq', 'ne', 'gt', 'ge',
+                        'and', 'or', 'invert'])
 
 
 class Cache(object):
 
-    def __init__(self, filenames, tile_cut={}, read_only=False):
+    def __init__(self, filenames, tile_cut={}, read_only=False,
+                 memory_budget=None):
         self._attrs = {}
+        self._materialized = OrderedDict()
+        self.memory_budget = memory_budget
         self.filenames = filenames
         self.tile_cut = tile_cut
         self.root = nc.tailor(filenames, dimensions=tile_cut,
                               read_only=read_only)
 
     def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
         if name not in self._attrs.keys():
             self.load(name)
         return self._attrs[name]
 
     def getvar(self, var_name):
-        return nc.getvar(self.root, var_name)
+        with netcdf_lock:
+            return nc.getvar(self.root, var_name)
 
     def load(self, name):
         var_name = name[4:] if name[0:4] == 'ref_' else name
         key = 'ref_{:s}'.format(var_name)
         if key not in self._attrs.keys():
-            var = self.getvar(var_name)
-            self._attrs[key] = var
+            self._attrs[key] = self.getvar(var_name)
+        self._attrs[var_name] = LazyVariable(self, var_name, self._attrs[key])
+
+    def materialized(self, name):
+        return self._materialized.get(name, None)
+
+    def materialize(self, name):
+        """
+        Return the whole content of the variable, reading it if it isn't
+        in memory and evicting the least recently used variables to keep
+        the memory budget (in bytes).
+        """
+        if name in self._materialized:
+            array = self._materialized.pop(name)
         else:
-            var = self._attrs
-        self._attrs[var_name] = var[:]
+            with netcdf_lock:
+                array = self._attrs['ref_{:s}'.format(name)][:]
+        self._materialized[name] = array
+        self.evict()
+        return array
+
+    def evict(self):
+        used = lambda: sum(map(lambda a: a.nbytes,
+                               self._materialized.values()))
+        while (self.memory_budget is not None and
+               len(self._materialized) > 1 and used() > self.memory_budget):
+            name, array = self._materialized.popitem(last=False)
+            logging.debug("Evicting {:s} from memory.".format(name))
 
     def dump(self):
         for k in self._attrs.keys():
             self._attrs.pop(k, None)
+        self._materialized.clear()
         nc.close(self.root)
 
 
+def project_map((name, month, lat, lon)):
+    if name == 'dem':
+        return dem.obtain(lat, lon)
+    linkes = linke.obtain(datetime(2014, month, 15), compressed=True)
+    return linke.transform_data(linkes, lat, lon)
+
+
 class StaticCache(Cache):
 
+    SATELLITAL = ['satellitalzenithangle', 'satellital_opticalpath',
+                  'satellital_opticaldepth']
+
     @classmethod
-    def project_dem(cls, root, lat, lon):
+    def project_dem(cls, root, lat, lon, dem_map=None):
         logging.info("Projecting DEM's map... ")
         dem_var = nc.getvar(root, 'dem', 'f4', source=lon)
-        dem_var[:] = dem.obtain(lat[0], lon[0])
+        dem_var[:] = (dem.obtain(lat[0], lon[0]) if dem_map is None
+                      else dem_map)
 
     @classmethod
-    def project_linke(cls, root, lat, lon):
+    def project_linke(cls, root, lat, lon, linkes=None):
         logging.info("Projecting Linke's turbidity index... ")
-        dts = map(lambda m: datetime(2014, m, 15), range(1, 13))
-        linkes = map(lambda dt: linke.obtain(dt, compressed=True), dts)
-        linkes = map(lambda l: linke.transform_data(l, lat[0],
-                                                    lon[0]), linkes)
+        if linkes is None:
+            linkes = map(lambda month: project_map(('linke', month, lat[0],
+                                                    lon[0])),
+                         range(1, 13))
         linkes = np.vstack([[linkes]])
         nc.getdim(root, 'months', 12)
         linke_var = nc.getvar(root, 'linke', 'f4', ('months', 'yc', 'xc'))
@@ -64,7 +175,59 @@ class StaticCache(Cache):
         linke_var[:] = linkes / 20.
 
     @classmethod
-    def construct(cls, static_file, ref_filename):
+    def project_maps(cls, lat, lon, processes=None):
+        """
+        Return the DEM and the 12 monthly Linke turbidity maps of the grid,
+        projecting them concurrently in a pool of processes.
+        """
+        # It is imported here to avoid a circular import.
+        from core import mp_map
+        logging.info("Projecting the DEM and the Linke's turbidity maps "
+                     "concurrently... ")
+        tasks = ([('dem', None, lat, lon)] +
+                 map(lambda month: ('linke', month, lat, lon), range(1, 13)))
+        maps = mp_map(project_map, tasks, processes)
+        return maps[0], maps[1:]
+
+    @classmethod
+    def project_satellital(cls, root, lat, lon, sat_lon):
+        logging.info("Projecting the satellital geometry... ")
+        # It is imported here to avoid a circular import.
+        from cpu import CPUStrategy
+        dem_var = nc.getvar(root, 'dem')
+        geometry = CPUStrategy.calculate_satellitalgeometry(
+            lat[:], lon[:], dem_var[:], sat_lon)
+        for name, values in zip(cls.SATELLITAL, geometry):
+            var = nc.getvar(root, name, 'f8', source=lon)
+            var[:] = values
+
+    @classmethod
+    def hash_grid(cls, lat, lon, sat_lon=None):
+        grid = hashlib.sha1(np.ascontiguousarray(lat).tostring())
+        grid.update(np.ascontiguousarray(lon).tostring())
+        grid.update(repr(sat_lon))
+        return grid.hexdigest()
+
+    @classmethod
+    def grid_key(cls, ref_filename, sat_lon=None):
+        """
+        Return a hash of the lat/lon grid (and the sub satellite longitude)
+        of a data file, which identifies the static fields of the grid.
+        """
+        with nc.loader(ref_filename) as root_ref:
+            return cls.hash_grid(nc.getvar(root_ref, 'lat')[:],
+                                 nc.getvar(root_ref, 'lon')[:], sat_lon)
+
+    @classmethod
+    def construct(cls, static_file, ref_filename, sat_lon=None, store=None,
+                  processes=None):
+        if store:
+            stored = '{:s}/{:s}.nc'.format(
+                store, cls.grid_key(ref_filename, sat_lon))
+            if os.path.exists(stored):
+                logging.info("Reusing the static fields {:s}".format(stored))
+                shutil.copyfile(stored, static_file)
+                return
         # At first it should have: lat, lon, dem, linke
         logging.info("This is the first execution from the deployment... ")
         with nc.loader(ref_filename) as root_ref:
@@ -73,51 +236,142 @@ class StaticCache(Cache):
                 lon = nc.getvar(root_ref, 'lon')
                 nc.getvar(root, 'lat', source=lat)
                 nc.getvar(root, 'lon', source=lon)
-                cls.project_dem(root, lat, lon)
-                cls.project_linke(root, lat, lon)
+                dem_map, linkes = cls.project_maps(lat[0], lon[0],
+                                                   processes)
+                cls.project_dem(root, lat, lon, dem_map)
+                cls.project_linke(root, lat, lon, linkes)
+                if sat_lon is not None:
+                    cls.project_satellital(root, lat, lon, sat_lon)
+        if store:
+            if not os.path.exists(store):
+                os.makedirs(store)
+            tmp_filename = '{:s}.{:d}.tmp'.format(stored, os.getpid())
+            shutil.copyfile(static_file, tmp_filename)
+            os.rename(tmp_filename, stored)
 
-    def __init__(self, static_filename, data_filenames, tile_cut):
+    def __init__(self, static_filename, data_filenames, tile_cut,
+                 sat_lon=None, dtype=None, store=None):
         if not os.path.exists(static_filename):
             StaticCache.construct(static_filename,
-                                  data_filenames[0])
+                                  data_filenames[0], sat_lon, store)
         super(StaticCache, self).__init__(static_filename, tile_cut)
+        self.dtype = dtype
+
+    def cast(self, array):
+        return array if self.dtype is None else array.astype(self.dtype)
+
+    def read(self, name):
+        with netcdf_lock:
+            return self.cast(nc.getvar(self.root, name)[:])
+
+    @property
+    def lat(self):
+        if not hasattr(self, '_cached_lat'):
+            self._cached_lat = self.read('lat')
+        return self._cached_lat
+
+    @property
+    def lon(self):
+        if not hasattr(self, '_cached_lon'):
+            self._cached_lon = self.read('lon')
+        return self._cached_lon
 
     @property
     def dem(self):
         if not hasattr(self, '_cached_dem'):
-            self._cached_dem = nc.getvar(self.root, 'dem')[:]
+            self._cached_dem = self.read('dem')
         return self._cached_dem
 
     @property
     def linke(self):
         if not hasattr(self, '_linke'):
-            self._linke = nc.getvar(self.root, 'linke')[:]
+            self._linke = self.read('linke')
         return self._linke
 
+    @property
+    def satellital(self):
+        """
+        Return the satellital zenith angle, optical path and optical depth
+        projected inside the static file, or None if the file was
+        constructed without them.
+        """
+        if not hasattr(self, '_satellital'):
+            try:
+                self._satellital = tuple(map(self.read, self.SATELLITAL))
+            except Exception, e:
+                logging.warn(e)
+                self._satellital = None
+        return self._satellital
+
 
 class OutputCache(Cache):
 
-    def __init__(self, product, tile_cut, ref_filenames):
+    PRODUCTS = ['cloudindex', 'globalradiation']
+
+    def __init__(self, product, tile_cut, ref_filenames, dtype=None,
+                 queue_size=4):
         super(OutputCache, self).__init__(ref_filenames,
                                           tile_cut)
         self.product = product
+        self.dtype = dtype
+        self.queue_size = queue_size
+        self.writer = None
         self.initialize_variables(self.filenames)
 
+    def write(self, name, index, array):
+        """
+        Store a chunk of the variable name. The chunks of the product files
+        are written by a background ProductWriter.
+        """
+        if not self.output_path:
+            getattr(self, 'ref_{:s}'.format(name))[index] = array
+            return
+        if self.writer is None:
+            self.writer = ProductWriter(self, self.queue_size)
+        self.writer.put(name, index, array)
+
+    def flush(self):
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+
     def create_1px_dimensions(self, root):
         nc.getdim(root, 'xc_k', 1)
         nc.getdim(root, 'yc_k', 1)
         nc.getdim(root, 'time', 1)
 
+    def create_product(self, filename, image):
+        """
+        Create the product file of the image with its variables compressed
+        and chunked by tile, so reading or writing a tile only touches the
+        chunks of that tile.
+        """
+        with closing(netCDF4.Dataset(image)) as source:
+            dimensions = source.variables['data'].dimensions
+            sizes = map(lambda d: len(source.dimensions[d]), dimensions)
+        chunks = map(lambda d, size: min(size, scheduler.TILE_SHAPE.get(d, 1)),
+                     dimensions, sizes)
+        tmp_filename = '{:s}.{:d}.tmp'.format(filename, os.getpid())
+        with closing(netCDF4.Dataset(tmp_filename, 'w',
+                                     format='NETCDF4')) as root:
+            map(root.createDimension, dimensions, sizes)
+            for name in self.PRODUCTS:
+                root.createVariable(name, 'f4', dimensions, zlib=True,
+                                    complevel=4, shuffle=True,
+                                    chunksizes=chunks)
+        os.rename(tmp_filename, filename)
+
     def initialize_path(self, filenames, images):
         if not os.path.exists(self.output_path):
             os.makedirs(self.output_path)
-        self.output = Cache(map(self.get_output_file, self.filenames),
-                            tile_cut=self.tile_cut)
+        outputs = map(self.get_output_file, self.filenames)
+        for output, image in zip(outputs, self.filenames):
+            if not os.path.exists(output):
+                self.create_product(output, image)
+        self.output = Cache(outputs, tile_cut=self.tile_cut)
         self.root = self.output.root
         map(self.create_1px_dimensions, self.root.roots)
         self.root.getvar('time', source=images.getvar('time'))
-        self.root.getvar('cloudindex', 'f4', source=images.getvar('data'))
-        self.root.getvar('globalradiation', 'f4', source=images.getvar('data'))
 
     def initialize_variables(self, filenames):
         self.path = '/'.join(filenames[0].split('/')[0:-1])
@@ -128,9 +382,9 @@ class OutputCache(Cache):
             else:
                 data_shape = images.getvar('data').shape
                 self.time = np.zeros(images.getvar('time').shape)
-                self.ref_cloudindex = np.zeros(data_shape)
+                self.ref_cloudindex = np.zeros(data_shape, self.dtype)
                 self.cloudindex = self.ref_cloudindex
-                self.ref_globalradiation = np.zeros(data_shape)
+                self.ref_globalradiation = np.zeros(data_shape, self.dtype)
                 self.globalradiation = self.ref_globalradiation
 
     def get_output_file(self, filename):
@@ -138,15 +392,188 @@ class OutputCache(Cache):
                                   short(filename, None, None))
 
 
+class EphemerisCache(object):
+    """
+    Store the solar zenith angle of each timestamp over a lat/lon grid (the
+    one of the tile) in a dtype as memory mapped files next to the static
+    file, so the overlapping windows of the next runs reuse it. The
+    timestamps older than the window (of days) are removed.
+    """
+
+    SECONDS_PER_DAY = 86400
+
+    def __init__(self, static_filename, lat, lon, dtype=None, days=31):
+        # The window of filter_data begins at the date of 30 days ago.
+        self.days = days
+        self.path = '{:s}.ephemeris/{:s}.{:s}'.format(
+            os.path.splitext(static_filename)[0],
+            StaticCache.hash_grid(lat, lon),
+            np.dtype(dtype or np.float64).name)
+
+    def get_filename(self, time):
+        return '{:s}/{:d}.npy'.format(self.path, int(time))
+
+    def store(self, filename, array):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        tmp_filename = '{:s}.{:d}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            np.save(f, array)
+        os.rename(tmp_filename, filename)
+
+    def obtain(self, times, calculate):
+        """
+        Return the stacked solar zenith angles of the times, using
+        calculate(positions) to obtain the ones that aren't stored yet.
+        """
+        filenames = map(self.get_filename, times)
+        missing = [i for i, f in enumerate(filenames)
+                   if not os.path.exists(f)]
+        logging.info("Ephemeris: {:d} stored, {:d} missing.".format(
+            len(filenames) - len(missing), len(missing)))
+        if missing:
+            for i, array in zip(missing, calculate(missing)):
+                self.store(filenames[i], array)
+        result = np.array(map(lambda f: np.load(f, mmap_mode='r'),
+                              filenames))
+        if len(times):
+            self.expire(max(times))
+        return result
+
+    def expire(self, newest):
+        oldest = newest - self.days * self.SECONDS_PER_DAY
+        for filename in glob.glob('{:s}/*.npy'.format(self.path)):
+            time = os.path.splitext(os.path.basename(filename))[0]
+            if int(time) < oldest:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+
+class CalibrationCache(object):
+    """
+    Content addressed store of the calibrated images (as float32) of the
+    input files, keyed by the path and the modification time of each file
+    and by the tile_cut, so the overlapping windows of the next runs
+    calibrate each image once. When the store exceeds max_bytes the least
+    recently used images are evicted.
+    """
+
+    def __init__(self, path, tile_cut={}, max_bytes=None):
+        self.path = path
+        self.tile_key = scheduler.key(tile_cut)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def get_filename(self, filename):
+        key = '{:s}:{:f}:{:s}'.format(os.path.abspath(filename),
+                                      os.path.getmtime(filename),
+                                      self.tile_key)
+        return '{:s}/{:s}.npy'.format(self.path,
+                                      hashlib.sha1(key).hexdigest())
+
+    def store(self, filename, array):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        tmp_filename = '{:s}.{:d}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            np.save(f, np.asarray(array, np.float32))
+        os.rename(tmp_filename, filename)
+
+    def load(self, filename):
+        # Another process could evict the file at any moment, so a file that
+        # can't be read is a miss. Its modification time tracks its last use.
+        try:
+            os.utime(filename, None)
+            return np.load(filename)
+        except (IOError, OSError):
+            return None
+
+    def obtain(self, filenames, calculate):
+        """
+        Return the stacked calibrated images of the filenames, using
+        calculate(positions) to obtain the ones that aren't stored yet.
+        """
+        cached = map(self.get_filename, filenames)
+        loaded = map(self.load, cached)
+        missing = [i for i, array in enumerate(loaded) if array is None]
+        self.hits += len(cached) - len(missing)
+        self.misses += len(missing)
+        logging.info("Calibration cache: {:d} hits, {:d} misses.".format(
+            self.hits, self.misses))
+        if missing:
+            for i, array in zip(missing, calculate(missing)):
+                self.store(cached[i], array)
+                loaded[i] = np.asarray(array, np.float32)
+        result = np.vstack(loaded)
+        self.evict()
+        return result
+
+    def stat(self, filename):
+        try:
+            return (os.path.getmtime(filename), os.path.getsize(filename),
+                    filename)
+        except OSError:
+            return None
+
+    def evict(self):
+        if not self.max_bytes:
+            return
+        files = filter(None, map(self.stat,
+                                 glob.glob('{:s}/*.npy'.format(self.path))))
+        total = sum(map(lambda (mtime, size, f): size, files))
+        for mtime, size, filename in sorted(files):
+            if total <= self.max_bytes:
+                break
+            logging.debug("Evicting {:s} from the calibration cache.".format(
+                filename))
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+
 class memoize(object):
+    """
+    Memoize the results of a method by instance and arguments. The results
+    are indexed by a weak reference to the instance, so they are released
+    with it, and only the maxsize most recently used results of each
+    instance are kept.
+    """
 
-    def __init__(self, function):
+    def __init__(self, function=None, maxsize=128):
         self.function = function
-        self.memoized = {}
+        self.maxsize = maxsize
+        self.memoized = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
 
     def __call__(self, *args):
-        try:
-            return self.memoized[args]
-        except KeyError:
-            self.memoized[args] = self.function(*args)
-        return self.memoized[args]
+        if self.function is None:
+            # Used as @memoize(maxsize=...).
+            self.function, = args
+            return self
+        instance, key = args[0], args[1:]
+        results = self.memoized.setdefault(instance, OrderedDict())
+        if key in results:
+            self.hits += 1
+            results[key] = results.pop(key)
+            return results[key]
+        self.misses += 1
+        results[key] = self.function(*args)
+        while len(results) > self.maxsize:
+            results.popitem(last=False)
+        return results[key]
+
+    def clear(self, instance=None):
+        if instance is None:
+            self.memoized.clear()
+        else:
+            self.memoized.pop(instance, None)
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'instances': len(self.memoized), 'maxsize': self.maxsize}
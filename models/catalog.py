@@ -0,0 +1,136 @@
+from helpers import short, to_datetime
+from datetime import datetime, timedelta
+import calendar
+import sqlite3
+import glob
+import pytz
+import os
+
+
+GMT = pytz.timezone('GMT')
+LOCAL = pytz.timezone('America/Argentina/Buenos_Aires')
+
+
+class Catalog(object):
+    """
+    SQLite catalog of the available images, indexed by time. The names
+    of the files are parsed once, when they are added to the catalog, so
+    the selection of the files of a job is an indexed query.
+    """
+
+    def __init__(self, filename='catalog.db'):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS images ('
+                'path TEXT PRIMARY KEY, timestamp INTEGER, '
+                'local_hour INTEGER, satellite TEXT, band TEXT, '
+                'size INTEGER)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS images_timestamp '
+                'ON images (timestamp)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS directories ('
+                'path TEXT PRIMARY KEY, mtime REAL)')
+
+    def describe(self, filename):
+        dt = to_datetime(filename)
+        local = GMT.localize(dt).astimezone(LOCAL)
+        return (filename, calendar.timegm(dt.timetuple()), local.hour,
+                short(filename, 0, 1), short(filename, -2, -1),
+                os.path.getsize(filename))
+
+    def contains(self, filename):
+        return self.connection.execute(
+            'SELECT 1 FROM images WHERE path = ?', (filename,)).fetchone()
+
+    def insert(self, filenames):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)',
+                map(self.describe, filenames))
+
+    def remove(self, filenames):
+        with self.connection:
+            self.connection.executemany('DELETE FROM images WHERE path = ?',
+                                        map(lambda f: (f,), filenames))
+
+    def add(self, filenames):
+        """
+        Add the filenames (like the ones just downloaded) that aren't in the
+        catalog yet.
+        """
+        pending = filter(lambda f: not self.contains(f), filenames)
+        self.insert(pending)
+        return len(pending)
+
+    def update(self, pattern):
+        """
+        Add the files of the pattern that aren't in the catalog yet and
+        remove the ones that don't exist anymore. Only the directories
+        modified since the last update are listed again.
+        """
+        directory, name = os.path.split(pattern)
+        directories = (filter(os.path.isdir, glob.glob(directory))
+                       if directory else [''])
+        mtimes = dict(self.connection.execute(
+            'SELECT path, mtime FROM directories WHERE path GLOB ?',
+            (directory,)))
+        for path in set(mtimes.keys()) - set(directories):
+            self.sweep(path, name, [])
+        added = 0
+        for path in directories:
+            # The modification time is taken before listing, so the files
+            # added meanwhile are listed by the next update.
+            mtime = os.path.getmtime(path or '.')
+            if mtimes.get(path) != mtime:
+                added += self.sweep(path, name,
+                                    glob.glob(os.path.join(path, name)), mtime)
+        return added
+
+    def sweep(self, directory, name, files, mtime=None):
+        """
+        Synchronize the catalogued files of the directory with the files
+        listed in it, recording its modification time.
+        """
+        known = set(filter(lambda f: os.path.dirname(f) == directory,
+                           self.paths(os.path.join(directory, name))))
+        self.remove(known - set(files))
+        pending = set(files) - known
+        self.insert(pending)
+        with self.connection:
+            if mtime is None:
+                self.connection.execute(
+                    'DELETE FROM directories WHERE path = ?', (directory,))
+            else:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO directories VALUES (?, ?)',
+                    (directory, mtime))
+        return len(pending)
+
+    def paths(self, pattern='*'):
+        return map(lambda row: row[0], self.connection.execute(
+            'SELECT path FROM images WHERE path GLOB ?', (pattern,)))
+
+    def select(self, pattern, days=30, first_hour=6, last_hour=20):
+        """
+        Return the files of the pattern of the last days (until the last
+        image) with a local hour between first_hour and last_hour, like
+        JobDescription.filter_data.
+        """
+        last, = self.connection.execute(
+            'SELECT MAX(timestamp) FROM images WHERE path GLOB ?',
+            (pattern,)).fetchone()
+        if last is None:
+            return []
+        last_dt = datetime.utcfromtimestamp(last)
+        a_month_ago = (last_dt - timedelta(days=days)).date()
+        begin = calendar.timegm(a_month_ago.timetuple())
+        return map(lambda row: row[0], self.connection.execute(
+            'SELECT path FROM images WHERE timestamp >= ? AND '
+            'local_hour >= ? AND local_hour <= ? AND path GLOB ? '
+            'ORDER BY timestamp', (begin, first_hour, last_hour, pattern)))
+
+    def close(self):
+        self.connection.close()
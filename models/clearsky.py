@@ -0,0 +1,93 @@
+"""
+Fused evaluation of the ESRA clear sky model used by the CPUStrategy.
+
+Each step of the model is evaluated as a single expression over
+preallocated outputs. The expressions are evaluated by numexpr (listed in
+requirements.txt) in one (multithreaded) pass without temporaries. If it
+isn't installed the same expressions are evaluated with NumPy, which
+allocates a temporary for each operation.
+"""
+import numpy as np
+import logging
+try:
+    import numexpr
+except ImportError, e:
+    logging.warning('numexpr is not available, the fused clear sky is '
+                    'evaluated with NumPy ({:s}).'.format(str(e)))
+    numexpr = None
+
+
+# The average extraterrestrial irradiance is 1367.0 Watts/meter^2
+EXTRATERRESTRIAL_IRRADIANCE = 1367.0
+# The maximum height of the non-transparent atmosphere is at 8434.5 mts
+ATMOSPHERE_HEIGHT = 8434.5
+FUNCTIONS = {'where': np.where, 'exp': np.exp, 'sin': np.sin, 'cos': np.cos}
+
+ELEVATION = '(elevation * rad)'
+CORRECTED_ELEVATION = (
+    '({e} + 0.061359 * ((0.1594 + 1.1230 * {e} + 0.065656 * {e} ** 2) /'
+    ' (1 + 28.9344 * {e} + 277.3971 * {e} ** 2))) / rad').format(e=ELEVATION)
+# The negative corrected elevations are set to zero to avoid the use of
+# complex numbers.
+POSITIVE_ELEVATION = 'where(elevation < 0, 0, elevation)'
+OPTICAL_PATH = (
+    'exp(-dem / height) / (sin({h} * rad) +'
+    ' 0.50572 * ({h} + 6.07995) ** -1.6364)').format(h=POSITIVE_ELEVATION)
+OPTICAL_DEPTH = (
+    'where(path <= 20,'
+    ' 1 / (6.6296 + 1.7513 * path - 0.1202 * path ** 2 +'
+    ' 0.0065 * path ** 3 - 0.00013 * path ** 4),'
+    ' 1 / (10.4 + 0.718 * path))')
+BEAM_TRANSMISSION = 'exp(-0.8662 * linke * path * {:s})'.format(OPTICAL_DEPTH)
+ZENITH_DIFFUSE = '(-0.015843 + 0.030543 * linke + 0.0003797 * linke ** 2)'
+A0 = '(0.264631 - 0.061581 * linke + 0.0031408 * linke ** 2)'
+A1 = '(2.0402 + 0.018945 * linke - 0.011161 * linke ** 2)'
+A2 = '(-1.3025 + 0.039231 * linke + 0.0085079 * linke ** 2)'
+DIFFUSE_TRANSMITANCE = (
+    '{trd} * (where({a0} * {trd} < 0.002, 0.002 / {trd}, {a0}) +'
+    ' {a1} * sin({e}) + {a2} * sin({e}) ** 2)').format(
+        trd=ZENITH_DIFFUSE, a0=A0, a1=A1, a2=A2, e=ELEVATION)
+SATELLITAL_TRANSMITANCE = (
+    'exp(-0.8662 * linke * path * depth) + {:s}'.format(DIFFUSE_TRANSMITANCE))
+
+
+def evaluate(expression, out, **variables):
+    variables['rad'] = np.pi / 180.
+    if numexpr:
+        numexpr.evaluate(expression, local_dict=variables, out=out,
+                         casting='same_kind')
+    else:
+        out[:] = eval(expression, FUNCTIONS, variables)
+    return out
+
+
+def esra(excentricity, solarangle, solarelevation, linke, dem,
+         satellitalelevation, satellital_opticalpath,
+         satellital_opticaldepth, dtype=np.float64):
+    """
+    Return the global and diffuse clear sky irradiance, and the earth and
+    satellital transmitances.
+    """
+    shape = np.broadcast(excentricity, solarangle, linke, dem).shape
+    gc, dc, t_earth, t_sat = [np.empty(shape, dtype) for i in range(4)]
+    height = ATMOSPHERE_HEIGHT
+    i0 = EXTRATERRESTRIAL_IRRADIANCE
+    # The outputs are used as scratch before they get their final values.
+    correctedelevation = evaluate(CORRECTED_ELEVATION, t_sat,
+                                  elevation=solarelevation)
+    opticalpath = evaluate(OPTICAL_PATH, gc, elevation=correctedelevation,
+                           dem=dem, height=height)
+    beam = evaluate(BEAM_TRANSMISSION, t_earth, linke=linke,
+                    path=opticalpath)
+    diffuse = evaluate(DIFFUSE_TRANSMITANCE, dc, linke=linke,
+                       elevation=solarelevation)
+    evaluate('i0 * excentricity * (cos(zenith * rad) * beam + diffuse)', gc,
+             i0=i0, excentricity=excentricity, zenith=solarangle, beam=beam,
+             diffuse=diffuse)
+    evaluate('beam + diffuse', t_earth, beam=beam, diffuse=diffuse)
+    evaluate('i0 * excentricity * diffuse', dc, i0=i0,
+             excentricity=excentricity, diffuse=diffuse)
+    evaluate(SATELLITAL_TRANSMITANCE, t_sat, linke=linke,
+             path=satellital_opticalpath, depth=satellital_opticaldepth,
+             elevation=satellitalelevation)
+    return gc, dc, t_earth, t_sat
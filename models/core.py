@@ -1,8 +1,11 @@
 from datetime import datetime
 import numpy as np
-from multiprocessing import Process, Pipe
-from itertools import izip
+from multiprocessing import Pool, cpu_count
+from itertools import izip, repeat
 from cache import memoize
+import profiler
+import tempfile
+import os
 # import multiprocessing as mp
 # import os
 import logging
@@ -14,35 +17,43 @@ class ProcessingStrategy(object):
         self.algorithm = algorithm
         self.initialize_slots(loader, self)
 
+    @property
+    def profiler(self):
+        return getattr(self.algorithm, 'profiler', None) or profiler.disabled
+
     def int_to_dt(self, time):
         return datetime.utcfromtimestamp(int(time))
 
+    @property
+    @memoize
+    def datetimes(self):
+        return self.times.astype(np.int64).astype('datetime64[s]')
+
     @property
     @memoize
     def months(self):
-        months = map(lambda t: self.int_to_dt(t).month, self.times)
-        return np.array(months).reshape(self.times.shape)
+        months = self.datetimes.astype('datetime64[M]').astype(int) % 12 + 1
+        return months.reshape(self.times.shape)
 
     @property
     @memoize
     def gamma(self):
-        to_julianday = lambda time: self.int_to_dt(time).timetuple().tm_yday
-        days_of_year = lambda time: to_julianday(
-            (datetime(self.int_to_dt(time).year, 12, 31)).timetuple()[7])
-        times = self.times
-        total_days = np.array(map(days_of_year, times)).reshape(times.shape)
-        julian_day = np.array(map(to_julianday, times)).reshape(times.shape)
+        days = self.datetimes.astype('datetime64[D]')
+        years = self.datetimes.astype('datetime64[Y]').astype('datetime64[D]')
+        julian_day = (days - years).astype(int) + 1
+        # The previous decoding took the year length as the day of the year
+        # of the timestamp 365 (1970-01-01), so it was always 1. It is kept
+        # to obtain the same products.
+        total_days = np.ones_like(julian_day)
         return self.getdailyangle(julian_day, total_days)
 
     @property
     @memoize
     def decimalhour(self):
-        int_to_dt = lambda t: datetime.utcfromtimestamp(t)
-        int_to_decimalhour = (lambda time: int_to_dt(time).hour +
-                              int_to_dt(time).minute/60.0 +
-                              int_to_dt(time).second/3600.0)
-        result = map(int_to_decimalhour, self.times)
-        return np.array(result).reshape(self.times.shape)
+        days = self.datetimes.astype('datetime64[D]')
+        seconds = (self.datetimes - days).astype(int)
+        return (seconds // 3600 + (seconds % 3600) // 60 / 60.0 +
+                (seconds % 60) / 3600.0)
 
     def calculate_slots(self, images_per_hour):
         return np.round(self.decimalhour * images_per_hour).astype(int)
@@ -59,20 +70,132 @@ class ProcessingStrategy(object):
         self.calculate_imagedata(static, loader, output)
 
 
-def spawn(f):
-    def fun(pipe, x):
-        pipe.send(f(x))
-        pipe.close()
-    return fun
-
-
-def mp_map(f, X):
-    pipe = [Pipe() for x in X]
-    proc = [Process(target=spawn(f), args=(c, x))
-            for x, (p, c) in izip(X, pipe)]
-    [p.start() for p in proc]
-    [p.join() for p in proc]
-    return [p.recv() for (p, c) in pipe]
+SHM_PATH = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedArray(object):
+    """
+    Move an array between processes through a memory mapped file (on
+    /dev/shm when it is available) instead of pickling its content.
+    """
+
+    def __init__(self, array):
+        self.dtype, self.shape = array.dtype, array.shape
+        f, self.filename = tempfile.mkstemp(dir=SHM_PATH, suffix='.shared')
+        os.close(f)
+        shared = np.memmap(self.filename, dtype=self.dtype, mode='w+',
+                           shape=self.shape)
+        shared[:] = array
+        shared.flush()
+        del shared
+
+    def attach(self):
+        array = np.memmap(self.filename, dtype=self.dtype, mode='r+',
+                          shape=self.shape)
+        # The mapping keeps the memory alive after the file is removed.
+        os.remove(self.filename)
+        return array
+
+    def release(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    @classmethod
+    def is_shareable(cls, obj):
+        return (type(obj) is np.ndarray and obj.size > 0 and
+                not obj.dtype.hasobject)
+
+
+def share(obj):
+    if SharedArray.is_shareable(obj):
+        return SharedArray(obj)
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(map(share, obj))
+    if isinstance(obj, dict):
+        return dict((k, share(v)) for k, v in obj.items())
+    return obj
+
+
+def unshare(obj):
+    if isinstance(obj, SharedArray):
+        return obj.attach()
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(map(unshare, obj))
+    if isinstance(obj, dict):
+        return dict((k, unshare(v)) for k, v in obj.items())
+    return obj
+
+
+def release(obj):
+    if isinstance(obj, SharedArray):
+        obj.release()
+    elif isinstance(obj, (tuple, list)):
+        map(release, obj)
+    elif isinstance(obj, dict):
+        map(release, obj.values())
+
+
+def drain(results):
+    """
+    Release the shared memory of the results that weren't consumed.
+    """
+    while True:
+        try:
+            release(next(results))
+        except StopIteration:
+            return
+        except Exception, e:
+            logging.debug(e)
+
+
+def execute((f, x)):
+    return share(f(x))
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of worker processes. The tasks are submitted in chunks
+    of chunksize items, the results are returned in the submission order
+    and their arrays come back through shared memory. The function should
+    be picklable (defined at module level).
+    """
+
+    def __init__(self, processes=None, chunksize=1):
+        self.processes = processes or cpu_count()
+        self.chunksize = chunksize
+        self.pool = None
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def imap(self, f, X):
+        if self.pool is None:
+            self.pool = Pool(self.processes)
+        results = self.pool.imap(execute, izip(repeat(f), X), self.chunksize)
+        self.pending.append(results)
+        return (unshare(r) for r in results)
+
+    def map(self, f, X):
+        return list(self.imap(f, X))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            # A consumer that stopped early (or failed) leaves the rest of
+            # its results in shared memory.
+            map(drain, self.pending)
+            self.pending = []
+            self.pool = None
+
+
+def mp_map(f, X, processes=None, chunksize=1):
+    with WorkerPool(processes, chunksize) as pool:
+        return pool.map(f, X)
 
 
 helper = {}
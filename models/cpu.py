@@ -1,7 +1,14 @@
 import numpy as np
 import stats
+import reducers
+import clearsky
 from core import ProcessingStrategy
+from prefetch import Prefetcher
+from store import calibration, CALIBRATION
+from helpers import netcdf_lock
 import logging
+from itertools import izip
+import os
 
 
 GREENWICH_LON = 0.0
@@ -9,6 +16,13 @@ GREENWICH_LON = 0.0
 
 class CPUStrategy(ProcessingStrategy):
 
+    def __init__(self, algorithm, loader):
+        super(CPUStrategy, self).__init__(algorithm, loader)
+        if getattr(algorithm, 'config', {}).get('lut'):
+            # It is imported here to avoid a circular import.
+            import lut
+            lut.install(self)
+
     def getexcentricity(self, gamma):
         gamma = np.deg2rad(gamma)
         return (1.000110 + 0.034221 * np.cos(gamma) +
@@ -51,27 +65,57 @@ class CPUStrategy(ProcessingStrategy):
                           np.cos(dec) * np.cos(lat) *
                           np.cos(hourlyangle)))
 
-    def getcalibrateddata(self, loader):
+    def getcalibrateddata(self, loader, index=None, calibrated=None):
+        if index is not None:
+            return self.calibrate(loader, index, calibrated)
         if not hasattr(self, '_cached_calibrated_data'):
-            raw_data = loader.data[:]
-            counts_shift = loader.counts_shift[:]
-            space_measurement = loader.space_measurement[:]
-            prelaunch = loader.prelaunch_0[:]
-            # INFO: Without the postlaunch coefficient the RMSE go to 15%
-            postlaunch = loader.postlaunch[:]
-            normalized_data = (np.float32(raw_data) / counts_shift -
-                               space_measurement)
-            self._cached_calibrated_data = (normalized_data
-                                            * postlaunch
-                                            * prelaunch)
+            self._cached_calibrated_data = self.calibrate(loader)
         return self._cached_calibrated_data
 
+    def readcalibrateddata(self, loader, index=slice(None)):
+        store = getattr(self.algorithm, 'store', None)
+        if store is not None:
+            return store.read(loader.filenames, index,
+                              self.algorithm.config.get('tile_cut', {}))
+        cache = getattr(self.algorithm, 'calibration', None)
+        if cache is not None:
+            positions = np.arange(len(loader.filenames))[index]
+            read = lambda i: calibration(*self.readvariables(
+                loader, CALIBRATION, slice(i, i + 1)))
+            return cache.obtain(
+                map(lambda i: loader.filenames[i], positions),
+                lambda missing: map(lambda m: read(positions[m]), missing))
+        return calibration(*self.readvariables(loader, CALIBRATION, index))
+
+    def readvariables(self, loader, names, index):
+        # The hyperslabs are read while holding the lock, the other threads
+        # could be reading or writing netCDF files.
+        with netcdf_lock:
+            return map(lambda name: loader.getvar(name)[index], names)
+
+    def calibrate(self, loader, index=slice(None), calibrated=None):
+        if calibrated is None:
+            calibrated = self.readcalibrateddata(loader, index)
+        return self.cast(calibrated)
+
+    @property
+    def dtype(self):
+        return np.dtype(self.algorithm.config.get('precision') or np.float64)
+
+    def cast(self, array):
+        """
+        Convert the array to the precision of the job (if it has one).
+        """
+        precision = self.algorithm.config.get('precision')
+        return array if precision is None else np.asarray(array, precision)
+
     def getalbedo(self, radiance, totalirradiance, excentricity, zenithangle):
         zenithangle = np.deg2rad(zenithangle)
         return (np.pi * radiance) / (totalirradiance * excentricity
                                      * np.cos(zenithangle))
 
-    def getsatellitalzenithangle(self, lat, lon, sub_lon):
+    @staticmethod
+    def getsatellitalzenithangle(lat, lon, sub_lon):
         rpol = 6356.5838
         req = 6378.1690
         h = 42166.55637  # 42164.0
@@ -88,7 +132,8 @@ class CPUStrategy(ProcessingStrategy):
         return np.rad2deg(np.pi - np.arccos((h ** 2 - re ** 2 - rs ** 2) /
                                             (-2 * re * rs)))
 
-    def getcorrectedelevation(self, elevation):
+    @staticmethod
+    def getcorrectedelevation(elevation):
         elevation = np.deg2rad(elevation)
         return np.rad2deg(elevation
                           + 0.061359 * ((0.1594 + 1.1230 * elevation +
@@ -120,7 +165,8 @@ class CPUStrategy(ProcessingStrategy):
         return (a0 + a1 * np.sin(solarelevation)
                 + a2 * np.power(np.sin(solarelevation), 2))
 
-    def getopticalpath(self, correctedelevation, terrainheight,
+    @staticmethod
+    def getopticalpath(correctedelevation, terrainheight,
                        atmosphere_theoretical_height):
         # It set all the negative correctedelevation's values to zero to
         # avoid the use of complex numbers.
@@ -133,8 +179,9 @@ class CPUStrategy(ProcessingStrategy):
         return (np.exp(-terrainheight/atmosphere_theoretical_height) /
                 (np.sin(correctedelevation) + 0.50572 * power))
 
-    def getopticaldepth(self, opticalpath):
-        tmp = np.zeros(opticalpath.shape) + 1.0
+    @staticmethod
+    def getopticaldepth(opticalpath):
+        tmp = np.ones(opticalpath.shape, np.result_type(opticalpath, 1.0))
         highslopebeam = opticalpath <= 20
         lowslopebeam = opticalpath > 20
         opticalpath_power = lambda p: np.power(opticalpath[highslopebeam], p)
@@ -180,7 +227,8 @@ class CPUStrategy(ProcessingStrategy):
     def getdailyangle(self, julianday, totaldays):
         return np.rad2deg(2 * np.pi * (julianday - 1) / totaldays)
 
-    def getelevation(self, zenithangle):
+    @staticmethod
+    def getelevation(zenithangle):
         zenithangle = np.deg2rad(zenithangle)
         return np.rad2deg((np.pi / 2) - zenithangle)
 
@@ -205,7 +253,8 @@ class CPUStrategy(ProcessingStrategy):
         apparentalbedo[apparentalbedo < 0] = 0.0
         return apparentalbedo
 
-    def geteffectivealbedo(self, solarangle):
+    @staticmethod
+    def geteffectivealbedo(solarangle):
         solarangle = np.deg2rad(solarangle)
         return 0.78 - 0.13 * (1 - np.exp(-4 * np.power(np.cos(solarangle), 5)))
 
@@ -220,19 +269,46 @@ class CPUStrategy(ProcessingStrategy):
         cloudalbedo[condition] = effectiveproportion[condition]
         return cloudalbedo
 
-    def calculate_temporaldata(self, static, loader):
-        lat, lon = static.lat, static.lon
-        self.declination = self.getdeclination(self.gamma)
-        hourlyangle = self.gethourlyangle(lat, lon,
-                                          self.decimalhour,
-                                          self.gamma)
-        self.solarangle = self.getzenithangle(self.declination,
-                                              lat,
-                                              hourlyangle)
-        self.solarelevation = self.getelevation(self.solarangle)
-        self.excentricity = self.getexcentricity(self.gamma)
-        linke = np.vstack([map(lambda m: static.linke[0, m[0][0] - 1, :],
-                               self.months.tolist())])
+    @classmethod
+    def calculate_satellitalgeometry(cls, lat, lon, dem, sub_lon):
+        satellitalzenithangle = cls.getsatellitalzenithangle(lat, lon,
+                                                             sub_lon)
+        satellitalelevation = cls.getelevation(satellitalzenithangle)
+        satellital_opticalpath = cls.getopticalpath(
+            cls.getcorrectedelevation(satellitalelevation),
+            dem, 8434.5)
+        satellital_opticaldepth = cls.getopticaldepth(satellital_opticalpath)
+        return (satellitalzenithangle, satellital_opticalpath,
+                satellital_opticaldepth)
+
+    def getsatellitalgeometry(self, static):
+        if static.satellital is not None:
+            return static.satellital
+        return self.calculate_satellitalgeometry(static.lat, static.lon,
+                                                 static.dem,
+                                                 self.algorithm.SAT_LON)
+
+    def calculate_solarangle(self, static, index):
+        gamma = self.cast(self.gamma[index])
+        hourlyangle = self.gethourlyangle(static.lat, static.lon,
+                                          self.cast(self.decimalhour[index]),
+                                          gamma)
+        return self.getzenithangle(self.getdeclination(gamma),
+                                   static.lat,
+                                   hourlyangle)
+
+    def getsolarangle(self, static, index):
+        ephemeris = self.algorithm.ephemeris
+        if not ephemeris:
+            return self.calculate_solarangle(static, index)
+        indexes = np.arange(len(self.times))[index]
+        return self.cast(ephemeris.obtain(
+            self.times[index].ravel(),
+            lambda missing: self.calculate_solarangle(static,
+                                                      indexes[missing])))
+
+    def calculate_clearsky(self, static, linke, satellitalelevation,
+                           satellital_opticalpath, satellital_opticaldepth):
         # The average extraterrestrial irradiance is 1367.0 Watts/meter^2
         # The maximum height of the non-transparent atmosphere is at 8434.5 mts
         bc = self.getbeamirradiance(1367.0, self.excentricity,
@@ -240,40 +316,108 @@ class CPUStrategy(ProcessingStrategy):
                                     linke, static.dem)
         dc = self.getdiffuseirradiance(1367.0, self.excentricity,
                                        self.solarelevation, linke)
-        self.gc = self.getglobalirradiance(bc, dc)
-        satellitalzenithangle = self.getsatellitalzenithangle(
-            lat, lon, self.algorithm.SAT_LON)
-        atmosphericradiance = self.getatmosphericradiance(
-            1367.0, self.algorithm.i0met, dc, satellitalzenithangle)
-        self.atmosphericalbedo = self.getalbedo(atmosphericradiance,
-                                                self.algorithm.i0met,
-                                                self.excentricity,
-                                                satellitalzenithangle)
-        satellitalelevation = self.getelevation(satellitalzenithangle)
-        satellital_opticalpath = self.getopticalpath(
-            self.getcorrectedelevation(satellitalelevation),
-            static.dem, 8434.5)
-        satellital_opticaldepth = self.getopticaldepth(satellital_opticalpath)
-        self.t_sat = self.gettransmitance(linke, satellital_opticalpath,
-                                          satellital_opticaldepth,
-                                          satellitalelevation)
+        gc = self.getglobalirradiance(bc, dc)
+        t_sat = self.gettransmitance(linke, satellital_opticalpath,
+                                     satellital_opticaldepth,
+                                     satellitalelevation)
         solar_opticalpath = self.getopticalpath(
             self.getcorrectedelevation(self.solarelevation),
             static.dem, 8434.5)
         solar_opticaldepth = self.getopticaldepth(solar_opticalpath)
-        self.t_earth = self.gettransmitance(linke, solar_opticalpath,
-                                            solar_opticaldepth,
-                                            self.solarelevation)
-        effectivealbedo = self.geteffectivealbedo(self.solarangle)
-        self.cloudalbedo = self.getcloudalbedo(effectivealbedo,
-                                               self.atmosphericalbedo,
-                                               self.t_earth,
-                                               self.t_sat)
+        t_earth = self.gettransmitance(linke, solar_opticalpath,
+                                       solar_opticaldepth,
+                                       self.solarelevation)
+        return gc, dc, t_earth, t_sat
+
+    def calculate_fusedclearsky(self, static, linke, satellitalelevation,
+                                satellital_opticalpath,
+                                satellital_opticaldepth):
+        return clearsky.esra(self.excentricity, self.solarangle,
+                             self.solarelevation, linke, static.dem,
+                             satellitalelevation, satellital_opticalpath,
+                             satellital_opticaldepth, self.dtype)
+
+    def getlinke(self, static, index=slice(None)):
+        """
+        Return the Linke turbidity of the images from the 12 monthly maps.
+        The images share the month (see calculate_temporaldata), so its map
+        is broadcasted over them instead of being copied for each image.
+        """
+        month = np.ravel(self.months[index])[0] - 1
+        return static.linke[0, month][np.newaxis]
+
+    TEMPORALDATA = ['declination', 'solarangle', 'solarelevation',
+                    'excentricity', 'gc', 't_earth', 't_sat',
+                    'atmosphericalbedo', 'cloudalbedo']
+
+    def calculate_monthlydata(self, static, loader, months):
+        """
+        Calculate the temporal data of the consecutive slices of months one
+        month at a time, and join them like if they were calculated at once.
+        """
+        offset, size = months[0].start, months[-1].stop - months[0].start
+        data = {}
+        for month in months:
+            self.calculate_temporaldata(static, loader, month)
+            for name in self.TEMPORALDATA:
+                value = getattr(self, name)
+                if name not in data:
+                    data[name] = np.empty((size,) + value.shape[-2:],
+                                          value.dtype)
+                data[name][month.start - offset:month.stop - offset] = value
+        for name, value in data.items():
+            setattr(self, name, value)
+
+    def calculate_temporaldata(self, static, loader, index=slice(None)):
+        positions = np.arange(len(self.times))[index]
+        months = self.getchunks(positions, len(positions))
+        if len(months) > 1:
+            # Each month broadcasts its own map of Linke turbidity.
+            return self.calculate_monthlydata(static, loader, months)
+        with self.profiler.stage('declination') as stage:
+            gamma = self.cast(self.gamma[index])
+            self.declination = self.getdeclination(gamma)
+            stage.produced(self.declination)
+        with self.profiler.stage('solar angle') as stage:
+            self.solarangle = self.getsolarangle(static, index)
+            self.solarelevation = self.getelevation(self.solarangle)
+            self.excentricity = self.getexcentricity(gamma)
+            stage.produced(self.solarangle, self.solarelevation,
+                           self.excentricity)
+        with self.profiler.stage('satellital geometry') as stage:
+            linke = self.getlinke(static, index)
+            (satellitalzenithangle, satellital_opticalpath,
+             satellital_opticaldepth) = self.getsatellitalgeometry(static)
+            satellitalelevation = self.getelevation(satellitalzenithangle)
+            stage.produced(linke, satellitalelevation)
+        calculate_clearsky = (self.calculate_fusedclearsky
+                              if self.algorithm.config.get('fused')
+                              else self.calculate_clearsky)
+        with self.profiler.stage('clear sky') as stage:
+            self.gc, dc, self.t_earth, self.t_sat = calculate_clearsky(
+                static, linke, satellitalelevation, satellital_opticalpath,
+                satellital_opticaldepth)
+            stage.produced(self.gc, dc, self.t_earth, self.t_sat)
+        with self.profiler.stage('atmospherical albedo') as stage:
+            atmosphericradiance = self.getatmosphericradiance(
+                1367.0, self.algorithm.i0met, dc, satellitalzenithangle)
+            self.atmosphericalbedo = self.getalbedo(atmosphericradiance,
+                                                    self.algorithm.i0met,
+                                                    self.excentricity,
+                                                    satellitalzenithangle)
+            stage.produced(self.atmosphericalbedo)
+        with self.profiler.stage('cloud albedo') as stage:
+            effectivealbedo = self.geteffectivealbedo(self.solarangle)
+            self.cloudalbedo = self.getcloudalbedo(effectivealbedo,
+                                                   self.atmosphericalbedo,
+                                                   self.t_earth,
+                                                   self.t_sat)
+            stage.produced(self.cloudalbedo)
 
     def getsecondmin(self, albedo):
-        min1_albedo = np.ma.masked_array(albedo,
-                                         albedo == np.amin(albedo, axis=0))
-        return np.amin(min1_albedo, axis=0)
+        tracker = reducers.TwoSmallest()
+        tracker.update(np.ma.getdata(albedo), np.ma.getmaskarray(albedo))
+        return tracker.secondmin()
 
     def getsolarelevation(self, declination, lat, omega):
         omega = np.deg2rad(omega)
@@ -299,61 +443,284 @@ class CPUStrategy(ProcessingStrategy):
         clearsky[cond] = 0.05
         return clearsky
 
-    def calculate_imagedata(self, static, loader, output):
-        excentricity = self.excentricity
-        solarangle = self.solarangle
-        atmosphericalbedo = self.atmosphericalbedo
-        t_earth = self.t_earth
-        t_sat = self.t_sat
-        observedalbedo = self.getalbedo(self.getcalibrateddata(loader),
+    def calculate_apparentalbedo(self, loader, index=None, calibrated=None):
+        calibrateddata = self.getcalibrateddata(loader, index, calibrated)
+        observedalbedo = self.getalbedo(calibrateddata,
                                         self.algorithm.i0met,
-                                        excentricity, solarangle)
+                                        self.excentricity, self.solarangle)
         apparentalbedo = self.getapparentalbedo(observedalbedo,
-                                                atmosphericalbedo,
-                                                t_earth, t_sat)
-        declination = self.declination
-        logging.info("Calculating the noon window... ")
+                                                self.atmosphericalbedo,
+                                                self.t_earth, self.t_sat)
+        return calibrateddata, apparentalbedo
+
+    def getnoonwindow(self, slots):
         slot_window_in_hours = 4
         image_per_day = 24 * self.algorithm.IMAGE_PER_HOUR
         noon_slot = image_per_day / 2
         half_window = self.algorithm.IMAGE_PER_HOUR * slot_window_in_hours/2
         min_slot = noon_slot - half_window
         max_slot = noon_slot + half_window
-        condition = ((self.slots >= min_slot) & (self.slots < max_slot))
-        condition = np.reshape(condition, condition.shape[0])
-        mask1 = (self.getcalibrateddata(loader)[condition] <=
-                 (self.algorithm.i0met / np.pi) * 0.03)
-        m_apparentalbedo = np.ma.masked_array(apparentalbedo[condition], mask1)
-        # To do the nexts steps needs a lot of memory
-        logging.info("Calculating the ground reference albedo... ")
-        mask2 = m_apparentalbedo < stats.scoreatpercentile(m_apparentalbedo, 5)
-        p5_apparentalbedo = np.ma.masked_array(m_apparentalbedo, mask2)
-        groundreferencealbedo = self.getsecondmin(p5_apparentalbedo)
-        # Calculate the solar elevation using times, latitudes and omega
-        logging.info("Calculating solar elevation... ")
-        r_alphanoon = self.getsolarelevation(declination, static.lat, 0)
+        condition = ((slots >= min_slot) & (slots < max_slot))
+        return np.reshape(condition, condition.shape[0])
+
+    def getalphanoon(self, declination, lat):
+        r_alphanoon = self.getsolarelevation(declination, lat, 0)
         r_alphanoon = r_alphanoon * 2./3.
         r_alphanoon[r_alphanoon > 40] = 40
         r_alphanoon[r_alphanoon < 15] = 15
-        solarelevation = self.solarelevation
-        logging.info("Calculating the ground minimum albedo... ")
-        groundminimumalbedo = self.getsecondmin(
-            np.ma.masked_array(
-                apparentalbedo[condition],
-                solarelevation[condition] < r_alphanoon[condition]))
+        return r_alphanoon
+
+    def getgroundalbedomasks(self, static, calibrateddata, condition):
+        # The reference albedo ignores the darkest pixels and the minimum
+        # albedo ignores the images with a low solar elevation.
+        reference_mask = (calibrateddata[condition] <=
+                          (self.algorithm.i0met / np.pi) * 0.03)
+        r_alphanoon = self.getalphanoon(self.declination[condition],
+                                        static.lat)
+        minimum_mask = self.solarelevation[condition] < r_alphanoon
+        return reference_mask, minimum_mask
+
+    def getpercentilethreshold(self, m_apparentalbedo, per):
+        if self.algorithm.config.get('percentile_mode') == 'pixel':
+            # Each pixel has its own threshold over its valid values.
+            return stats.selectpercentile(m_apparentalbedo, per, axis=0)
+        threshold = self.algorithm.config.get('percentile_threshold')
+        if threshold is not None:
+            # The threshold of a region is shared by all its tiles.
+            return threshold
+        # The global threshold is taken over all the values (the masked
+        # ones too), like the sorting scoreatpercentile did.
+        return stats.selectpercentile(np.ma.getdata(m_apparentalbedo), per)
+
+    def getgroundreferencealbedo(self, m_apparentalbedo):
+        # To do the nexts steps needs a lot of memory
+        logging.info("Calculating the ground reference albedo... ")
+        mask2 = m_apparentalbedo < self.getpercentilethreshold(
+            m_apparentalbedo, 5)
+        p5_apparentalbedo = np.ma.masked_array(m_apparentalbedo, mask2)
+        return self.getsecondmin(p5_apparentalbedo)
+
+    def getgroundalbedo(self, groundreferencealbedo, groundminimumalbedo):
         aux_2g0 = 2 * groundreferencealbedo
         aux_05g0 = 0.5 * groundreferencealbedo
         condition_2g0 = groundminimumalbedo > aux_2g0
         condition_05g0 = groundminimumalbedo < aux_05g0
         groundminimumalbedo[condition_2g0] = aux_2g0[condition_2g0]
         groundminimumalbedo[condition_05g0] = aux_05g0[condition_05g0]
+        return groundminimumalbedo
+
+    def calculate_imagedata(self, static, loader, output):
+        with self.profiler.stage('apparent albedo') as stage:
+            calibrateddata, apparentalbedo = self.calculate_apparentalbedo(
+                loader)
+            stage.produced(calibrateddata, apparentalbedo)
+        logging.info("Calculating the noon window... ")
+        with self.profiler.stage('ground reference albedo') as stage:
+            condition = self.getnoonwindow(self.slots)
+            reference_mask, minimum_mask = self.getgroundalbedomasks(
+                static, calibrateddata, condition)
+            groundreferencealbedo = self.getgroundreferencealbedo(
+                np.ma.masked_array(apparentalbedo[condition],
+                                   reference_mask))
+            stage.produced(reference_mask, minimum_mask,
+                           groundreferencealbedo)
+        logging.info("Calculating the ground minimum albedo... ")
+        with self.profiler.stage('ground minimum albedo') as stage:
+            groundminimumalbedo = self.getgroundalbedo(
+                groundreferencealbedo,
+                self.getsecondmin(np.ma.masked_array(
+                    apparentalbedo[condition], minimum_mask)))
+            stage.produced(groundminimumalbedo)
         logging.info("Calculating the cloud index... ")
-        cloudindex = self.getcloudindex(apparentalbedo,
-                                        groundminimumalbedo,
-                                        self.cloudalbedo)
-        output.ref_cloudindex[:] = cloudindex
-        output.ref_globalradiation[:] = (self.getclearsky(cloudindex) *
-                                         self.gc)
+        with self.profiler.stage('cloud index') as stage:
+            cloudindex = self.getcloudindex(apparentalbedo,
+                                            groundminimumalbedo,
+                                            self.cloudalbedo)
+            globalradiation = self.getclearsky(cloudindex) * self.gc
+            stage.produced(cloudindex, globalradiation)
+        with self.profiler.stage('writing'):
+            output.write('cloudindex', slice(None), cloudindex)
+            output.write('globalradiation', slice(None), globalradiation)
+
+    def getchunks(self, indexes, chunk_size):
+        """
+        Group a sorted sequence of indexes in slices of consecutive indexes
+        of the same month with at most chunk_size elements.
+        """
+        months = np.ravel(self.months)
+        chunks = []
+        for i in indexes:
+            if (chunks and chunks[-1][1] == i and
+                    chunks[-1][1] - chunks[-1][0] < chunk_size and
+                    months[i] == months[chunks[-1][0]]):
+                chunks[-1][1] = i + 1
+            else:
+                chunks.append([i, i + 1])
+        return map(lambda (begin, end): slice(begin, end), chunks)
+
+    def iterapparentalbedo(self, static, loader, chunks):
+        depth = self.algorithm.config.get('prefetch')
+        if not depth:
+            for index in chunks:
+                self.calculate_temporaldata(static, loader, index)
+                with self.profiler.stage('apparent albedo') as stage:
+                    result = self.calculate_apparentalbedo(loader, index)
+                    stage.produced(*result)
+                yield result
+            return
+        # The next chunks are read while the current one is computed, and the
+        # time waiting for them is profiled as the prefetch stall.
+        prefetcher = Prefetcher(
+            lambda index: self.readcalibrateddata(loader, index), chunks,
+            depth)
+        prefetched = iter(prefetcher)
+        try:
+            while True:
+                with self.profiler.stage('prefetch stall'):
+                    item = next(prefetched, None)
+                if item is None:
+                    return
+                index, calibrated = item
+                self.calculate_temporaldata(static, loader, index)
+                with self.profiler.stage('apparent albedo') as stage:
+                    result = self.calculate_apparentalbedo(loader, index,
+                                                           calibrated)
+                    stage.produced(*result)
+                yield result
+        finally:
+            # The consumers (like izip) could stop before the last chunk.
+            prefetched.close()
+
+    def stream_groundalbedo(self, static, loader, chunks):
+        logging.info("Calculating the ground minimum albedo by chunks... ")
+        sketch = reducers.PercentileSketch()
+        minimum = reducers.TwoSmallest()
+        for calibrateddata, apparentalbedo in self.iterapparentalbedo(
+                static, loader, chunks):
+            reference_mask, minimum_mask = self.getgroundalbedomasks(
+                static, calibrateddata, slice(None))
+            sketch.update(apparentalbedo)
+            minimum.update(apparentalbedo, minimum_mask)
+        logging.info("Calculating the ground reference albedo by chunks... ")
+        if self.algorithm.config.get('percentile_mode') == 'pixel':
+            # A threshold by pixel needs the valid noon window of each pixel.
+            return self.getgroundalbedo(
+                self.getgroundreferencealbedo(np.ma.concatenate(
+                    list(self.iternoonwindow(static, loader, chunks)))),
+                minimum.secondmin())
+        threshold = self.getsketchthreshold(sketch, 5)
+        reference = reducers.TwoSmallest()
+        for calibrateddata, apparentalbedo in self.iterapparentalbedo(
+                static, loader, chunks):
+            reference_mask, minimum_mask = self.getgroundalbedomasks(
+                static, calibrateddata, slice(None))
+            reference.update(apparentalbedo,
+                             reference_mask | (apparentalbedo < threshold))
+        return self.getgroundalbedo(reference.secondmin(),
+                                    minimum.secondmin())
+
+    def getsketchthreshold(self, sketch, per):
+        threshold = self.algorithm.config.get('percentile_threshold')
+        return sketch.percentile(per) if threshold is None else threshold
+
+    def summarize_groundalbedo(self, static, loader, chunks, state):
+        logging.info("Summarizing the ground albedo of each day... ")
+        for index, (calibrateddata, apparentalbedo) in izip(
+                chunks, self.iterapparentalbedo(static, loader, chunks)):
+            reference_mask, minimum_mask = self.getgroundalbedomasks(
+                static, calibrateddata, slice(None))
+            state.update(self.times[index], apparentalbedo, reference_mask,
+                         minimum_mask)
+        return state
+
+    def stream_groundalbedostate(self, static, loader, chunks, state):
+        self.summarize_groundalbedo(static, loader, chunks, state)
+        logging.info("Merging the ground albedo of {:d} days... ".format(
+            len(state.summaries)))
+        if self.algorithm.config.get('percentile_mode') == 'pixel':
+            # A threshold by pixel needs the valid noon window of each pixel.
+            return self.getgroundalbedo(
+                self.getgroundreferencealbedo(np.ma.concatenate(
+                    list(self.iternoonwindow(static, loader, chunks)))),
+                state.minimum())
+        threshold = self.getsketchthreshold(state.sketch(), 5)
+        return self.getgroundalbedo(state.reference(threshold),
+                                    state.minimum())
+
+    def iternoonwindow(self, static, loader, chunks):
+        for calibrateddata, apparentalbedo in self.iterapparentalbedo(
+                static, loader, chunks):
+            reference_mask, minimum_mask = self.getgroundalbedomasks(
+                static, calibrateddata, slice(None))
+            yield np.ma.masked_array(apparentalbedo, reference_mask)
+
+    def loadgroundalbedostate(self):
+        filename = self.algorithm.config.get('groundalbedo_state')
+        if filename and os.path.exists(filename):
+            logging.info("Loading the ground albedo state {:s}".format(
+                filename))
+            return reducers.GroundAlbedoState.load(filename)
+        return reducers.GroundAlbedoState()
+
+    def sketch_groundalbedo(self, static, loader):
+        """
+        Return the percentile sketch of the apparent albedo of the noon
+        window (of the whole sliding window when there is a ground albedo
+        state), without estimating the products.
+        """
+        condition = self.getnoonwindow(self.slots)
+        chunk_size = self.algorithm.config.get('chunk_size') or len(condition)
+        if self.algorithm.config.get('groundalbedo_state'):
+            state = self.loadgroundalbedostate()
+            noon = np.where(condition & state.pending(self.times))[0]
+            return self.summarize_groundalbedo(
+                static, loader, self.getchunks(noon, chunk_size),
+                state).sketch()
+        sketch = reducers.PercentileSketch()
+        for calibrateddata, apparentalbedo in self.iterapparentalbedo(
+                static, loader,
+                self.getchunks(np.where(condition)[0], chunk_size)):
+            sketch.update(apparentalbedo)
+        return sketch
+
+    def stream_globalradiation(self, static, loader, output, chunk_size):
+        condition = self.getnoonwindow(self.slots)
+        chunk_size = chunk_size or len(condition)
+        with self.profiler.stage('ground albedo'):
+            if self.algorithm.config.get('groundalbedo_state'):
+                # Only the sliding window of an incremental run is summarized
+                # by day, the rest of the runs reduce the images exactly.
+                state = self.loadgroundalbedostate()
+                noon = np.where(condition & state.pending(self.times))[0]
+                groundminimumalbedo = self.stream_groundalbedostate(
+                    static, loader, self.getchunks(noon, chunk_size), state)
+                # It is saved once the products are written.
+                self.groundalbedostate = state
+            else:
+                groundminimumalbedo = self.stream_groundalbedo(
+                    static, loader,
+                    self.getchunks(np.where(condition)[0], chunk_size))
+        logging.info("Calculating the cloud index by chunks... ")
+        chunks = self.getchunks(range(len(condition)), chunk_size)
+        for index, (calibrateddata, apparentalbedo) in izip(
+                chunks, self.iterapparentalbedo(static, loader, chunks)):
+            with self.profiler.stage('cloud index') as stage:
+                cloudindex = self.getcloudindex(apparentalbedo,
+                                                groundminimumalbedo,
+                                                self.cloudalbedo)
+                globalradiation = self.getclearsky(cloudindex) * self.gc
+                stage.produced(cloudindex, globalradiation)
+            with self.profiler.stage('writing'):
+                output.write('cloudindex', index, cloudindex)
+                output.write('globalradiation', index, globalradiation)
+
+    def estimate_globalradiation(self, static, loader, output):
+        config = self.algorithm.config
+        chunk_size = config.get('chunk_size')
+        if not (chunk_size or config.get('groundalbedo_state')):
+            return super(CPUStrategy, self).estimate_globalradiation(
+                static, loader, output)
+        self.stream_globalradiation(static, loader, output, chunk_size)
 
 
 strategy = CPUStrategy
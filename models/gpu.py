@@ -47,6 +47,11 @@ def gpu_exec(func_name, results, *matrixs):
 
 class GPUStrategy(CPUStrategy):
 
+    def estimate_globalradiation(self, static, loader, output):
+        # The kernels work over the whole stack, so it can't be streamed.
+        self.calculate_temporaldata(static, loader)
+        self.calculate_imagedata(static, loader, output)
+
     def calculate_temporaldata(self, static, loader):
         const = lambda c: np.array(c).reshape(1, 1, 1)
         inputs = [static.lat,
@@ -1,25 +1,42 @@
 #!/usr/bin/env python
 import core
+from cache import EphemerisCache, CalibrationCache
+from store import ImageStore
+from profiler import Profiler
 import numpy as np
 import logging
 import importlib
 from datetime import datetime
 
 
+# longitude of sub-satellite point in degrees
+SAT_LON = -75.113  # -75.3305
+
+
 class Heliosat2(object):
 
     def __init__(self, config, strategy_type):
         self.config = config
+        self.profiler = config.get('profiler') or Profiler()
         self.filenames = config['filenames']
         self.init_constants()
         self.loader = config['data']
         self.strategy = strategy_type(self, self.loader)
         self.static = config['static_file']
         self.output = config['product']
+        self.ephemeris = (EphemerisCache(self.static.filenames,
+                                         self.static.lat, self.static.lon,
+                                         config.get('precision'))
+                          if config.get('ephemeris') else None)
+        self.store = (ImageStore(config['store'])
+                      if config.get('store') else None)
+        self.calibration = (CalibrationCache(
+            config['calibration_cache'], config.get('tile_cut', {}),
+            config.get('calibration_cache_size'))
+            if config.get('calibration_cache') else None)
 
     def init_constants(self):
-        self.SAT_LON = -75.113
-        # -75.3305 # longitude of sub-satellite point in degrees
+        self.SAT_LON = SAT_LON
         self.IMAGE_PER_HOUR = 2
         self.GOES_OBSERVED_ALBEDO_CALIBRATION = 1.89544 * (10 ** (-3))
         self.i0met = np.pi / self.GOES_OBSERVED_ALBEDO_CALIBRATION
@@ -28,8 +45,23 @@ class Heliosat2(object):
         logging.info("Obtaining the global radiation... ")
         self.strategy.estimate_globalradiation(self.static,
                                                self.loader, self.output)
+        with self.profiler.stage('writing'):
+            self.output.flush()
+        self.save_groundalbedostate()
+        self.output.profile = self.profiler.to_dict()
         return self.output
 
+    def save_groundalbedostate(self):
+        # A run that fails before its products are written doesn't add its
+        # images to the state.
+        state = getattr(self.strategy, 'groundalbedostate', None)
+        if state is not None:
+            state.save(self.config['groundalbedo_state'])
+
+    def sketch_groundalbedo(self):
+        logging.info("Sketching the apparent albedo of the noon window... ")
+        return self.strategy.sketch_groundalbedo(self.static, self.loader)
+
     def run_with(self):
         logging.info("Take begin time.")
         begin = datetime.now()
@@ -39,8 +71,15 @@ class Heliosat2(object):
         return (end - begin).total_seconds(), output
 
 
-def run(**config):
+def create(config):
     config = core.check_hard(config)
     geo = importlib.import_module('models.{:s}'.format(config['hard']))
-    algorithm = Heliosat2(config, geo.strategy)
-    return algorithm.run_with()
+    return Heliosat2(config, geo.strategy)
+
+
+def run(**config):
+    return create(config).run_with()
+
+
+def sketch(**config):
+    return create(config).sketch_groundalbedo()
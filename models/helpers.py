@@ -1,6 +1,13 @@
 import sys
 sys.path.append(".")
 from datetime import datetime
+import threading
+
+
+# The netCDF library isn't thread safe, so the reads and writes of the
+# netCDF files (including the ones of the ProductWriter and the Prefetcher
+# threads) are serialized by this lock.
+netcdf_lock = threading.RLock()
 
 
 def short(f, start=1, end=-2):
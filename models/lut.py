@@ -0,0 +1,119 @@
+"""
+Lookup tables of the smooth functions of an angle used by the clear sky
+model. Each table is evaluated with a linear interpolation over a uniform
+grid, refined until the interpolation error (measured in the middle of
+every interval, where it is maximum for a smooth function) is under the
+tolerance of the table:
+
+    corrected elevation             1e-4 degrees
+    optical path denominator        1e-6
+    optical depth                   1e-7
+    effective albedo                1e-6
+
+The values outside the domain of a table are evaluated with the formula.
+"""
+import numpy as np
+from cpu import CPUStrategy
+
+
+class Table(object):
+
+    def __init__(self, function, lower, upper, tolerance, size=256,
+                 max_size=2 ** 20):
+        self.function = function
+        self.lower = lower
+        self.upper = upper
+        self.tolerance = tolerance
+        while True:
+            x = np.linspace(lower, upper, size)
+            y = function(x)
+            middle = (x[:-1] + x[1:]) / 2
+            self.error = np.abs(function(middle) - (y[:-1] + y[1:]) / 2).max()
+            if self.error <= tolerance or size >= max_size:
+                break
+            size = size * 2
+        self.size = size
+        self.y = y
+        self.slopes = np.diff(y)
+        self.typed = {}
+
+    def tables(self, dtype):
+        if dtype not in self.typed:
+            self.typed[dtype] = (self.y.astype(dtype),
+                                 self.slopes.astype(dtype))
+        return self.typed[dtype]
+
+    def __call__(self, x):
+        x = np.asarray(x)
+        dtype = x.dtype if x.dtype.kind == 'f' else np.dtype(np.float64)
+        y, slopes = self.tables(dtype)
+        scale = dtype.type((self.size - 1) / (self.upper - self.lower))
+        # The non finite values are outside the domain too.
+        outside = ~((x >= self.lower) & (x <= self.upper))
+        position = (np.clip(np.where(outside, self.lower, x), self.lower,
+                            self.upper) - dtype.type(self.lower)) * scale
+        index = np.minimum(position.astype(np.int32), self.size - 2)
+        result = (y.take(index) +
+                  (position - index.astype(dtype)) * slopes.take(index))
+        if outside.any():
+            result[outside] = self.function(x[outside])
+        return result
+
+
+def opticalpath_denominator(correctedelevation):
+    return (np.sin(np.deg2rad(correctedelevation)) +
+            0.50572 * np.power(correctedelevation + 6.07995, -1.6364))
+
+
+def highslope_opticaldepth(opticalpath):
+    return 1 / (6.6296 + 1.7513 * opticalpath - 0.1202 * opticalpath ** 2 +
+                0.0065 * opticalpath ** 3 - 0.00013 * opticalpath ** 4)
+
+
+def lowslope_opticaldepth(opticalpath):
+    return 1 / (10.4 + 0.718 * opticalpath)
+
+
+TABLES = {}
+
+
+def tables():
+    """
+    Return the tables, building them the first time.
+    """
+    if not TABLES:
+        TABLES.update({
+            'correctedelevation': Table(CPUStrategy.getcorrectedelevation,
+                                        -90., 90., 1e-4),
+            'opticalpath': Table(opticalpath_denominator, 0., 91., 1e-6),
+            'highslope': Table(highslope_opticaldepth, 0., 20., 1e-7),
+            'lowslope': Table(lowslope_opticaldepth, 20., 100., 1e-7),
+            'effectivealbedo': Table(CPUStrategy.geteffectivealbedo,
+                                     0., 180., 1e-6),
+        })
+    return TABLES
+
+
+def getopticalpath(correctedelevation, terrainheight,
+                   atmosphere_theoretical_height):
+    correctedelevation = np.maximum(correctedelevation, 0)
+    return (np.exp(-terrainheight/atmosphere_theoretical_height) /
+            tables()['opticalpath'](correctedelevation))
+
+
+def getopticaldepth(opticalpath):
+    # Each branch is evaluated inside its own domain.
+    return np.where(opticalpath <= 20,
+                    tables()['highslope'](np.minimum(opticalpath, 20)),
+                    tables()['lowslope'](np.maximum(opticalpath, 20)))
+
+
+def install(strategy):
+    """
+    Replace the formulas of the strategy with the tables.
+    """
+    strategy.getcorrectedelevation = tables()['correctedelevation']
+    strategy.getopticalpath = getopticalpath
+    strategy.getopticaldepth = getopticaldepth
+    strategy.geteffectivealbedo = tables()['effectivealbedo']
+    return strategy
@@ -0,0 +1,63 @@
+import threading
+import Queue
+import logging
+import time
+
+
+class Prefetcher(object):
+    """
+    Read the chunks of the input on an I/O thread, keeping up to depth
+    chunks ahead of the computation. The time the computation waits for
+    a chunk is accumulated in stall. The read function must hold the
+    helpers.netcdf_lock while it reads the netCDF files, so its reads don't
+    overlap with the ones of the main thread or the writes of the
+    ProductWriter.
+    """
+
+    def __init__(self, read, chunks, depth=2):
+        self.read = read
+        self.chunks = list(chunks)
+        self.queue = Queue.Queue(depth)
+        self.stopped = False
+        self.stall = 0.
+        self.reading = 0.
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def loop(self):
+        for index in self.chunks:
+            if self.stopped:
+                return
+            begin = time.time()
+            try:
+                item = (index, self.read(index), None)
+            except Exception, e:
+                item = (index, None, e)
+            self.reading += time.time() - begin
+            self.queue.put(item)
+            if item[2] is not None:
+                return
+
+    def __iter__(self):
+        try:
+            for i in range(len(self.chunks)):
+                begin = time.time()
+                index, data, error = self.queue.get()
+                self.stall += time.time() - begin
+                if error is not None:
+                    raise error
+                yield index, data
+        finally:
+            self.close()
+
+    def close(self):
+        self.stopped = True
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        logging.info("Prefetched {:d} chunks in {:.2f} seconds, waiting "
+                     "{:.2f} seconds for them.".format(
+                         len(self.chunks), self.reading, self.stall))
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import resource
+import json
+import time
+import os
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss():
+    """
+    Return the resident memory of the process in bytes (0 if it isn't
+    available).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (IOError, IndexError, ValueError):
+        return 0
+
+
+def peak_rss():
+    # The ru_maxrss is expressed in kilobytes on linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stage(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.
+        self.cpu = 0.
+        self.allocated = 0
+        self.peak = 0
+        self.bytes = 0
+
+    def produced(self, *arrays):
+        self.bytes += sum(map(lambda a: getattr(a, 'nbytes', 0), arrays))
+
+    def merge(self, other):
+        self.calls += other['calls']
+        self.wall += other['wall']
+        self.cpu += other['cpu']
+        self.allocated += other['allocated']
+        self.peak = max(self.peak, other['peak'])
+        self.bytes += other['bytes']
+
+    def to_dict(self):
+        return OrderedDict([('calls', self.calls), ('wall', self.wall),
+                            ('cpu', self.cpu),
+                            ('allocated', self.allocated),
+                            ('peak', self.peak), ('bytes', self.bytes)])
+
+
+class Profiler(object):
+    """
+    Record the wall time, the cpu time, the memory allocated (the growth of
+    the resident memory), the peak growth of the resident memory and the
+    bytes of the arrays produced of each named stage. The stages accumulate
+    over their calls, keeping the largest peak.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        stage = self.stages.setdefault(name, Stage())
+        if not self.enabled:
+            yield stage
+            return
+        cpu = sum(os.times()[0:2])
+        memory = rss()
+        maximum = peak_rss()
+        begin = time.time()
+        try:
+            yield stage
+        finally:
+            stage.calls += 1
+            stage.wall += time.time() - begin
+            stage.cpu += sum(os.times()[0:2]) - cpu
+            allocated = rss() - memory
+            stage.allocated += max(allocated, 0)
+            # If the stage raised the peak of the process, it is its peak.
+            # Otherwise the peak is only known to be above its end.
+            peak = peak_rss()
+            stage.peak = max(stage.peak, peak - memory if peak > maximum
+                             else allocated, 0)
+
+    def merge(self, stages, prefix=''):
+        for name, other in stages.items():
+            self.stages.setdefault(prefix + name, Stage()).merge(other)
+        return self
+
+    def to_dict(self):
+        return OrderedDict(map(lambda (name, stage): (name, stage.to_dict()),
+                               self.stages.items()))
+
+    def to_json(self, filename=None):
+        content = json.dumps(self.to_dict(), indent=2)
+        if filename:
+            with open(filename, 'w') as f:
+                f.write(content)
+        return content
+
+
+# Used by the strategies that run without a profiler.
+disabled = Profiler(enabled=False)
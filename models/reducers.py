@@ -0,0 +1,248 @@
+import os
+import numpy as np
+
+
+class TwoSmallest(object):
+    """
+    Exact running tracker of the smallest and the second smallest
+    (distinct) value of each pixel. It only keeps two images of state and
+    it can be updated with a single image or a stack of images.
+    """
+
+    def __init__(self):
+        self.first = None
+        self.second = None
+
+    @classmethod
+    def reduce(cls, values):
+        first = np.amin(values, axis=0)
+        second = np.amin(np.where(values > first, values, np.inf), axis=0)
+        return first, second.astype(first.dtype)
+
+    def merge(self, first, second):
+        if self.first is None:
+            self.first, self.second = first, second
+            return self
+        candidates = np.array([self.first, self.second, first, second])
+        self.first, self.second = self.reduce(candidates)
+        return self
+
+    def update(self, values, mask=None):
+        values = np.asarray(values)
+        if values.ndim == 2:
+            values = values.reshape((1,) + values.shape)
+        if mask is not None:
+            values = np.where(mask, np.inf, values).astype(values.dtype)
+        return self.merge(*self.reduce(values))
+
+    def secondmin(self):
+        return np.ma.masked_array(self.second, np.isinf(self.second))
+
+
+class PercentileSketch(object):
+    """
+    Fixed width histogram over [lower, upper) used to approximate a
+    percentile of a stream of values with a constant amount of memory.
+    When the percentile lies inside the range, the error of the estimation
+    is at most resolution / 2. The values outside the range (including the
+    non finite ones) are only counted.
+    """
+
+    def __init__(self, lower=0., upper=4., resolution=1e-4):
+        self.lower = lower
+        self.upper = upper
+        self.resolution = resolution
+        size = int(np.ceil((upper - lower) / resolution))
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def update(self, values):
+        values = np.asarray(values).ravel()
+        below = values < self.lower
+        inside = (values >= self.lower) & (values < self.upper)
+        self.underflow += int(below.sum())
+        self.overflow += values.size - int(inside.sum()) - int(below.sum())
+        bins = ((values[inside] - self.lower) /
+                self.resolution).astype(np.int64)
+        bins[bins >= len(self.counts)] = len(self.counts) - 1
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    @property
+    def size(self):
+        return int(self.counts.sum()) + self.underflow + self.overflow
+
+    def value(self, rank, cumulative):
+        position = np.searchsorted(cumulative, rank, side='right')
+        if position == 0:
+            return self.lower
+        if position > len(self.counts):
+            return self.upper
+        return self.lower + (position - 0.5) * self.resolution
+
+    def percentile(self, per):
+        """
+        Return the score at the percentile per, interpolating between two
+        ranks like stats.scoreatpercentile does.
+        """
+        if (per < 0) or (per > 100):
+            raise ValueError("percentile must be in the range [0, 100]")
+        if not self.size:
+            raise ValueError("the sketch is empty")
+        cumulative = np.cumsum(np.concatenate(([self.underflow],
+                                               self.counts)))
+        idx = per / 100. * (self.size - 1)
+        i = int(idx)
+        score = self.value(i, cumulative)
+        if i != idx:
+            score += (self.value(i + 1, cumulative) - score) * (idx - i)
+        return score
+
+
+class DaySummary(object):
+    """
+    Compact summary of the noon window of a single day: the percentile
+    sketch of the apparent albedo and the two smallest reference and
+    minimum albedo of each pixel.
+    """
+
+    def __init__(self, sketch=None):
+        self.sketch = sketch or PercentileSketch()
+        self.minimum = TwoSmallest()
+        self.reference = TwoSmallest()
+
+    def update(self, apparentalbedo, reference_mask, minimum_mask):
+        self.sketch.update(apparentalbedo)
+        self.minimum.update(apparentalbedo, minimum_mask)
+        self.reference.update(apparentalbedo, reference_mask)
+        return self
+
+
+class GroundAlbedoState(object):
+    """
+    Sliding window of day summaries of the ground albedo. Adding a day
+    expires the days older than the window, and the statistics of the
+    window are obtained by merging the summaries of the remaining days
+    instead of reducing every image again.
+
+    Each day only keeps its two smallest reference albedos, so the ones
+    below the percentile threshold of the window are dropped when the
+    summaries are merged. If both are below the threshold, the day does not
+    contribute to the reference albedo. That is why it is only used by the
+    runs with a groundalbedo_state file, the rest of the streaming runs
+    reduce the noon window exactly.
+    """
+
+    SECONDS_PER_DAY = 86400
+
+    def __init__(self, days=30):
+        self.days = days
+        self.summaries = {}
+        self.times = np.zeros(0)
+
+    def getdays(self, times):
+        return (np.ravel(times) // self.SECONDS_PER_DAY).astype(np.int64)
+
+    def pending(self, times):
+        return ~np.in1d(np.ravel(times), self.times)
+
+    def update(self, times, apparentalbedo, reference_mask, minimum_mask):
+        days = self.getdays(times)
+        for day in np.unique(days):
+            index = days == day
+            summary = self.summaries.setdefault(int(day), DaySummary())
+            summary.update(apparentalbedo[index], reference_mask[index],
+                           minimum_mask[index])
+        self.times = np.concatenate([self.times, np.ravel(times)])
+        self.expire()
+        return self
+
+    def expire(self):
+        if not self.summaries:
+            return
+        oldest = max(self.summaries.keys()) - self.days
+        for day in filter(lambda d: d < oldest, self.summaries.keys()):
+            del self.summaries[day]
+        self.times = self.times[self.getdays(self.times) >= oldest]
+
+    def sorted_summaries(self):
+        return map(lambda day: self.summaries[day],
+                   sorted(self.summaries.keys()))
+
+    def sketch(self):
+        summaries = self.sorted_summaries()
+        if not summaries:
+            # Like a run without noon images, the sketch is empty.
+            return PercentileSketch()
+        sketch = PercentileSketch(summaries[0].sketch.lower,
+                                  summaries[0].sketch.upper,
+                                  summaries[0].sketch.resolution)
+        for summary in summaries:
+            sketch.merge(summary.sketch)
+        return sketch
+
+    def percentile(self, per):
+        return self.sketch().percentile(per)
+
+    def check(self):
+        if not self.summaries:
+            raise ValueError("the ground albedo state is empty")
+
+    def minimum(self):
+        self.check()
+        summaries = self.sorted_summaries()
+        candidates = np.array(
+            [s.minimum.first for s in summaries] +
+            [s.minimum.second for s in summaries])
+        return TwoSmallest().update(candidates).secondmin()
+
+    def reference(self, threshold):
+        self.check()
+        summaries = self.sorted_summaries()
+        candidates = np.array(
+            [s.reference.first for s in summaries] +
+            [s.reference.second for s in summaries])
+        return TwoSmallest().update(
+            candidates, candidates < threshold).secondmin()
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            state = cls(int(f['window']))
+            state.times = f['times']
+            for i, day in enumerate(f['days']):
+                summary = DaySummary(PercentileSketch(*f['sketch_range']))
+                summary.sketch.counts = f['sketch_counts'][i]
+                summary.sketch.underflow, summary.sketch.overflow = map(
+                    int, f['sketch_outside'][i])
+                summary.minimum.merge(f['minimum_first'][i],
+                                      f['minimum_second'][i])
+                summary.reference.merge(f['reference_first'][i],
+                                        f['reference_second'][i])
+                state.summaries[int(day)] = summary
+        return state
+
+    def save(self, filename):
+        tmp_filename = '{:s}.tmp.npz'.format(filename)
+        summaries = self.sorted_summaries()
+        sketch = summaries[0].sketch if summaries else PercentileSketch()
+        stack = lambda f: np.array(map(f, summaries))
+        np.savez_compressed(
+            tmp_filename, window=self.days, times=self.times,
+            days=np.array(sorted(self.summaries.keys())),
+            sketch_range=[sketch.lower, sketch.upper, sketch.resolution],
+            sketch_counts=stack(lambda s: s.sketch.counts),
+            sketch_outside=stack(lambda s: [s.sketch.underflow,
+                                            s.sketch.overflow]),
+            minimum_first=stack(lambda s: s.minimum.first),
+            minimum_second=stack(lambda s: s.minimum.second),
+            reference_first=stack(lambda s: s.reference.first),
+            reference_second=stack(lambda s: s.reference.second))
+        os.rename(tmp_filename, filename)
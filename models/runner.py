@@ -3,9 +3,17 @@ from goesdownloader import instrument as goes
 from datetime import timedelta
 import importlib
 import glob
+import os
 import pytz
-from helpers import to_datetime
+from helpers import to_datetime, short
 from cache import StaticCache, Cache, OutputCache
+from core import WorkerPool
+from datetime import datetime
+import numpy as np
+from store import ImageStore
+from catalog import Catalog
+from profiler import Profiler
+import scheduler
 import logging
 
 
@@ -17,32 +25,81 @@ class JobDescription(object):
                  static_file='static.nc',
                  product=None,
                  tile_cut={},
-                 hard='cpu'):
+                 hard='cpu',
+                 chunk_size=None,
+                 percentile_mode='global',
+                 percentile_threshold=None,
+                 ephemeris=False,
+                 fused=False,
+                 precision=None,
+                 memory_budget=None,
+                 incremental=False,
+                 groundalbedo_state=None,
+                 prefetch=None,
+                 store=None,
+                 calibration_cache=None,
+                 calibration_cache_size=None,
+                 catalog=None,
+                 static_store=None,
+                 profile=None,
+                 lut=False):
         self.config = {
             'algorithm': 'models.{:s}'.format(algorithm),
             'data': data,
             'static_file': static_file,
             'product': product,
             'tile_cut': tile_cut,
-            'hard': hard
+            'hard': hard,
+            'chunk_size': chunk_size,
+            'percentile_mode': percentile_mode,
+            'percentile_threshold': percentile_threshold,
+            'ephemeris': ephemeris,
+            'fused': fused,
+            'precision': precision,
+            'memory_budget': memory_budget,
+            'incremental': incremental,
+            'groundalbedo_state': groundalbedo_state,
+            'prefetch': prefetch,
+            'store': store,
+            'calibration_cache': calibration_cache,
+            'calibration_cache_size': calibration_cache_size,
+            'catalog': catalog,
+            'static_store': static_store,
+            'profile': profile,
+            'lut': lut,
+            'profiler': Profiler()
         }
-        self.check_data()
-        self.load_data()
+        self.profiler = self.config['profiler']
+        self.window = None
+        with self.profiler.stage('selection'):
+            self.check_data()
+        if self.config['data'] or not incremental:
+            with self.profiler.stage('loading'):
+                self.load_data()
 
     def load_data(self):
         static = self.config['static_file']
         if isinstance(self.config['data'], (list, str)):
-            self.config['data'] = Cache(self.config['data'],
-                                        tile_cut=self.config['tile_cut'],
-                                        read_only=True)
+            self.config['data'] = Cache(
+                self.config['data'], tile_cut=self.config['tile_cut'],
+                read_only=True, memory_budget=self.config['memory_budget'])
         self.config['filenames'] = self.config['data'].filenames
+        if self.config['store']:
+            with self.profiler.stage('ingest'):
+                ImageStore(self.config['store']).ingest(
+                    self.config['filenames'])
         if isinstance(static, str):
-            self.config['static_file'] = StaticCache(static,
-                                                     self.config['filenames'],
-                                                     self.config['tile_cut'])
+            algorithm = importlib.import_module(self.config['algorithm'])
+            with self.profiler.stage('static'):
+                self.config['static_file'] = StaticCache(
+                    static, self.config['filenames'],
+                    self.config['tile_cut'],
+                    getattr(algorithm, 'SAT_LON', None),
+                    self.config['precision'], self.config['static_store'])
         self.config['product'] = OutputCache(self.config['product'],
                                              self.config['tile_cut'],
-                                             self.config['filenames'])
+                                             self.config['filenames'],
+                                             self.config['precision'])
 
     @classmethod
     def filter_data(cls, filename):
@@ -62,12 +119,94 @@ class JobDescription(object):
         files = filter(lambda f: daylight(to_datetime(f)), files)
         return files
 
+    def pending_data(self, files):
+        """
+        Keep the files whose products weren't completely written. The
+        ground albedo of the images already estimated is restored from the
+        groundalbedo_state file.
+        """
+        if not self.config['product']:
+            raise ValueError("The incremental mode needs a product path.")
+        if self.config['percentile_mode'] == 'pixel':
+            raise ValueError("The incremental mode needs the global "
+                             "percentile_mode.")
+        if not self.config['groundalbedo_state']:
+            self.config['groundalbedo_state'] = self.state_filename(
+                self.config['tile_cut'])
+        self.window = map(lambda f: short(f, None, None), files)
+        if not self.has_state():
+            # Without a state the whole window is estimated to rebuild it.
+            return files
+        estimated = self.estimated()
+        return filter(lambda f: short(f, None, None) not in estimated, files)
+
+    def has_state(self):
+        return os.path.exists(self.config['groundalbedo_state'])
+
+    @property
+    def product_path(self):
+        product = self.config['product']
+        return getattr(product, 'product', product)
+
+    def state_filename(self, tile_cut):
+        return '{:s}/groundalbedo.{:s}.npz'.format(self.product_path,
+                                                   scheduler.key(tile_cut))
+
+    def estimated_filename(self):
+        return '{:s}/estimated.{:s}.txt'.format(
+            self.product_path, scheduler.key(self.config['tile_cut']))
+
+    def estimated(self):
+        filename = self.estimated_filename()
+        if not os.path.exists(filename):
+            return set()
+        with open(filename) as f:
+            return set(f.read().split())
+
+    def mark_estimated(self):
+        """
+        Record the images of an incremental run once their products (and
+        the ground albedo state) are completely written, so the images of
+        a run that failed are estimated again.
+        """
+        if not self.config['incremental']:
+            return
+        names = self.estimated()
+        if self.window is not None:
+            # The images that left the window are forgotten.
+            names &= set(self.window)
+        names |= set(map(lambda f: short(f, None, None),
+                         self.config['filenames']))
+        filename = self.estimated_filename()
+        tmp_filename = '{:s}.{:d}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            f.write('\n'.join(sorted(names)))
+        os.rename(tmp_filename, filename)
+
+    @classmethod
+    def select_data(cls, filename, catalog):
+        catalog = Catalog(catalog)
+        try:
+            catalog.update(filename)
+            return catalog.select(filename)
+        finally:
+            catalog.close()
+
     def check_data(self):
-        if isinstance(self.config['data'], (str, list)):
+        if self.config['catalog'] and isinstance(self.config['data'], str):
+            self.config['data'] = self.select_data(self.config['data'],
+                                                   self.config['catalog'])
+        elif isinstance(self.config['data'], (str, list)):
             self.config['data'] = self.filter_data(self.config['data'])
+        if self.config['incremental'] and isinstance(self.config['data'],
+                                                     list):
+            self.config['data'] = self.pending_data(self.config['data'])
 
     def run(self):
         estimated = 0
+        if self.config['incremental'] and not self.config['data']:
+            logging.info("There are no new images to estimate.")
+            return estimated, None
         if isinstance(self.config['data'], (str, list)):
             m_lamb = lambda dt: '{:d}/{:d}'.format(dt.month, dt.year)
             months = list(set(map(m_lamb,
@@ -80,9 +219,135 @@ class JobDescription(object):
                 len(self.config['data'])))
         algorithm = importlib.import_module(self.config['algorithm'])
         estimated, output = algorithm.run(**self.config)
+        self.mark_estimated()
+        self.export_profile()
         logging.info("Process finished.")
         return estimated, output
 
+    def sketch(self):
+        """
+        Return the percentile sketch of the apparent albedo used to obtain
+        the threshold of the ground reference albedo.
+        """
+        algorithm = importlib.import_module(self.config['algorithm'])
+        return algorithm.sketch(**self.config)
+
+    def export_profile(self):
+        if self.config['profile']:
+            self.profiler.to_json(self.config['profile'])
+
+
+def run_tile(config):
+    job = JobDescription(**config)
+    estimated, output = job.run()
+    result = (config['tile_cut'], estimated,
+              np.array(output.cloudindex),
+              np.array(output.globalradiation),
+              job.profiler.to_dict())
+    job.config['data'].dump()
+    job.config['static_file'].dump()
+    return result
+
+
+def sketch_tile(config):
+    job = JobDescription(**config)
+    sketch = job.sketch()
+    job.config['data'].dump()
+    job.config['static_file'].dump()
+    return sketch
+
+
+class TiledJobDescription(JobDescription):
+
+    def __init__(self, tiles=None, tile_shape=scheduler.TILE_SHAPE,
+                 processes=None, chunksize=1, pool=None, **config):
+        super(TiledJobDescription, self).__init__(**config)
+        self.region, self.tiles = None, []
+        if 'filenames' in self.config:
+            shape = self.config['data'].getvar('data').shape
+            self.region = scheduler.bounds(self.config['tile_cut'], shape)
+            self.tiles = tiles or scheduler.split(self.region, tile_shape)
+        self.owns_pool = pool is None
+        self.pool = pool or WorkerPool(processes, chunksize)
+
+    def has_state(self):
+        # The tiles aren't known yet, each one has its own state.
+        return bool(glob.glob('{:s}/groundalbedo.*.npz'.format(
+            self.product_path)))
+
+    def tile_config(self, tile_cut):
+        config = dict(self.config)
+        # They are obtained by the JobDescription of each tile.
+        del config['filenames']
+        del config['profiler']
+        config.update({
+            'algorithm': self.config['algorithm'].split('.')[-1],
+            'data': self.config['filenames'],
+            'static_file': self.config['static_file'].filenames,
+            'product': None,
+            'tile_cut': tile_cut,
+            'groundalbedo_state': (self.state_filename(tile_cut)
+                                   if self.config['incremental'] else None),
+            # The images are selected and the profile is exported by the
+            # job of the whole region.
+            'incremental': False,
+            'profile': None,
+        })
+        return config
+
+    def percentile_threshold(self, configs):
+        """
+        Return the threshold of the ground reference albedo of the whole
+        region, merging the percentile sketches of its tiles, so the
+        products don't depend on the tile layout.
+        """
+        sketches = self.pool.imap(sketch_tile, configs)
+        sketch = reduce(lambda merged, other: merged.merge(other), sketches)
+        return sketch.percentile(5)
+
+    def stitch(self, output, tile_cut, cloudindex, globalradiation):
+        index = scheduler.offsets(self.region, tile_cut)
+        output.write('cloudindex', index, cloudindex)
+        output.write('globalradiation', index, globalradiation)
+
+    def run(self):
+        if not self.tiles:
+            if self.owns_pool:
+                self.pool.close()
+            return super(TiledJobDescription, self).run()
+        logging.info("Dataset: {:d} files splitted in {:d} tiles.".format(
+            len(self.config['filenames']), len(self.tiles)))
+        output = self.config['product']
+        begin = datetime.now()
+        configs = map(self.tile_config, self.tiles)
+        try:
+            if (self.config['percentile_mode'] != 'pixel' and
+                    self.config['percentile_threshold'] is None):
+                with self.profiler.stage('percentile'):
+                    threshold = self.percentile_threshold(configs)
+                configs = map(lambda config: dict(
+                    config, percentile_threshold=threshold), configs)
+            results = self.pool.imap(run_tile, configs)
+            for (tile_cut, estimated, cloudindex, globalradiation,
+                 profile) in results:
+                logging.info("Tile {:s} estimated in {:.2f} seconds.".format(
+                    str(tile_cut), estimated))
+                self.profiler.merge(profile)
+                with self.profiler.stage('stitching'):
+                    self.stitch(output, tile_cut, cloudindex,
+                                globalradiation)
+            with self.profiler.stage('writing'):
+                output.flush()
+            self.mark_estimated()
+        finally:
+            if self.owns_pool:
+                self.pool.close()
+        end = datetime.now()
+        output.profile = self.profiler.to_dict()
+        self.export_profile()
+        logging.info("Process finished.")
+        return (end - begin).total_seconds(), output
+
 
 logging.basicConfig(level=logging.INFO)
 
@@ -0,0 +1,67 @@
+import json
+import os
+import socket
+
+
+CONFIG_FILE = '{:s}/config.json'.format(os.path.dirname(__file__) or '.')
+TILE_SHAPE = {'yc': 100, 'xc': 100}
+
+
+def load_config(filename=CONFIG_FILE):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def from_config(filename=CONFIG_FILE, machine=None):
+    """
+    Return the tile cuts described by the "tails" section of the
+    config file. If a machine is given (the hostname by default) and it
+    appears in the "machines" section, only its tails are returned.
+    """
+    config = load_config(filename)
+    tails = config['tails']
+    machine = machine or socket.gethostname()
+    names = config.get('machines', {}).get(machine, sorted(tails.keys()))
+    if not isinstance(names, list):
+        names = [names]
+    return map(lambda name: dict(tails[str(name)]['dimensions']), names)
+
+
+def bounds(tile_cut, shape):
+    """
+    Return the absolute [begin, end] of each dimension of a tile_cut,
+    using the shape of the data to complete the missing dimensions.
+    """
+    complete = lambda name, size: list(tile_cut.get(name, [0, size]))
+    return {'yc': complete('yc', shape[-2]),
+            'xc': complete('xc', shape[-1])}
+
+
+def key(tile_cut):
+    """
+    Return a short name of a tile_cut, useful to name its files.
+    """
+    cut = lambda name: '{:s}{:d}-{:d}'.format(name, *tile_cut[name])
+    return '.'.join(map(cut, sorted(tile_cut.keys()))) or 'full'
+
+
+def split(region, tile_shape=TILE_SHAPE):
+    """
+    Split a region (a complete tile_cut) into tiles of at most tile_shape
+    pixels.
+    """
+    steps = lambda name: range(region[name][0], region[name][1],
+                               tile_shape[name])
+    cut = lambda name, begin: [begin, min(begin + tile_shape[name],
+                                          region[name][1])]
+    return [{'yc': cut('yc', y), 'xc': cut('xc', x)}
+            for y in steps('yc') for x in steps('xc')]
+
+
+def offsets(region, tile):
+    """
+    Return the slices that locate a tile inside a region.
+    """
+    relative = lambda name: slice(tile[name][0] - region[name][0],
+                                  tile[name][1] - region[name][0])
+    return (slice(None), relative('yc'), relative('xc'))
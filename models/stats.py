@@ -114,4 +114,62 @@ def _compute_qth_percentile(sorted, per, interpolation_method, axis):
         sumval = weights.sum()
 
     # Use np.add.reduce to coerce data type
-    return np.add.reduce(sorted[indexer] * weights, axis=axis) / sumval
\ No newline at end of file
+    return np.add.reduce(sorted[indexer] * weights, axis=axis) / sumval
+
+
+def selectpercentile(a, per, axis=None, interpolation_method='fraction'):
+    """
+    Calculate the score at a given percentile like scoreatpercentile, but
+    selecting the needed elements with a partition (O(n)) instead of
+    sorting the whole array (O(n log n)).
+
+    The masked values of a masked array are ignored, so when an axis is
+    given each slice has its own number of valid values. The slices
+    without valid values are masked in the result.
+
+    Parameters
+    ----------
+    a : array_like
+        Array (or masked array) of values from which to extract score.
+    per : scalar
+        Percentile at which to extract score. Should be in range [0,100].
+    axis : int, optional
+        Axis along which the percentiles are computed. The default (None)
+        is to compute the percentile along a flattened version of the array.
+    interpolation_method : {'fraction', 'lower', 'higher'}, optional
+        See scoreatpercentile.
+
+    Returns
+    -------
+    score : float (or masked array of floats)
+        Score at percentile.
+    """
+    if (per < 0) or (per > 100):
+        raise ValueError("percentile must be in the range [0, 100]")
+    if axis is None:
+        a = np.ma.ravel(a)
+        axis = 0
+    mask = np.ma.getmaskarray(a)
+    # The masked values are moved to the end of each slice.
+    values = np.rollaxis(np.where(mask, np.inf, np.ma.getdata(a)), axis)
+    count = np.rollaxis(~mask, axis).sum(axis=0)
+    last = np.maximum(count - 1, 0)
+    idx = per / 100. * last
+    if interpolation_method == 'lower':
+        idx = np.floor(idx)
+    elif interpolation_method == 'higher':
+        idx = np.ceil(idx)
+    elif interpolation_method != 'fraction':
+        raise ValueError("interpolation_method can only be 'fraction', "
+                         "'lower' or 'higher'")
+    i = np.floor(idx).astype(int)
+    j = np.minimum(i + 1, last)
+    kth = np.unique(np.concatenate([np.ravel(i), np.ravel(j)]))
+    partitioned = np.partition(values, kth, axis=0)
+    grid = tuple(np.indices(count.shape))
+    score = (partitioned[(i,) + grid] * (i + 1 - idx) +
+             partitioned[(j,) + grid] * (idx - i))
+    if mask.any():
+        score = np.ma.masked_array(score, count == 0)
+    return score[()] if score.ndim == 0 else score
+
@@ -0,0 +1,120 @@
+from netcdf import netcdf as nc
+from helpers import short, to_datetime
+import numpy as np
+import logging
+import os
+
+
+CALIBRATION = ['data', 'counts_shift', 'space_measurement', 'prelaunch_0',
+               'postlaunch']
+
+
+def calibration(raw_data, counts_shift, space_measurement, prelaunch,
+                postlaunch):
+    # INFO: Without the postlaunch coefficient the RMSE go to 15%
+    normalized_data = (np.float32(raw_data) / counts_shift -
+                       space_measurement)
+    return normalized_data * postlaunch * prelaunch
+
+
+class ImageStore(object):
+    """
+    Time stacked store of the calibrated images (as float32). The stack is
+    split in chunks of (time, yc, xc) pixels saved as npy files, so a tile
+    is read as contiguous slabs and the time series of a pixel costs one
+    read by chunk instead of opening every image.
+    """
+
+    def __init__(self, path, chunks=(16, 100, 100)):
+        self.path = path
+        self.index_filename = '{:s}/index.npz'.format(path)
+        self.names = []
+        self.shape = None
+        self.chunks = tuple(chunks)
+        if os.path.exists(self.index_filename):
+            with np.load(self.index_filename) as f:
+                self.names = list(f['names'])
+                self.shape = tuple(f['shape'])
+                self.chunks = tuple(f['chunks'])
+
+    def get_filename(self, t, y, x):
+        return '{:s}/{:d}.{:d}.{:d}.npy'.format(self.path, t, y, x)
+
+    def save(self, filename, save, *args):
+        tmp_filename = '{:s}.{:d}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            save(f, *args)
+        os.rename(tmp_filename, filename)
+
+    def ingest(self, filenames):
+        """
+        Append the images not stored yet, sorted by time.
+        """
+        stored = set(self.names)
+        pending = sorted(filter(lambda f: short(f, None, None) not in stored,
+                                filenames), key=to_datetime)
+        if not pending:
+            return self
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        logging.info("Ingesting {:d} images into {:s}... ".format(
+            len(pending), self.path))
+        ct = self.chunks[0]
+        # The images are grouped by the time chunk they complete.
+        while pending:
+            size = ct - len(self.names) % ct
+            self.append(pending[:size])
+            pending = pending[size:]
+        return self
+
+    def append(self, filenames):
+        images = []
+        for filename in filenames:
+            with nc.loader(filename) as root:
+                images.append(calibration(*map(
+                    lambda name: nc.getvar(root, name)[:], CALIBRATION)))
+        images = np.vstack(images).astype(np.float32)
+        self.shape = self.shape or images.shape[1:]
+        t = len(self.names) // self.chunks[0]
+        for y in range(0, self.shape[0], self.chunks[1]):
+            for x in range(0, self.shape[1], self.chunks[2]):
+                slab = images[:, y:y + self.chunks[1], x:x + self.chunks[2]]
+                filename = self.get_filename(t, y // self.chunks[1],
+                                             x // self.chunks[2])
+                if os.path.exists(filename):
+                    slab = np.vstack([np.load(filename), slab])
+                self.save(filename, np.save, slab)
+        self.names.extend(map(lambda f: short(f, None, None), filenames))
+        self.save(self.index_filename, np.savez, names=self.names,
+                  shape=self.shape, chunks=self.chunks)
+
+    def locate(self, filenames):
+        positions = dict(map(reversed, enumerate(self.names)))
+        return np.array(map(lambda f: positions[short(f, None, None)],
+                            filenames))
+
+    def read(self, filenames, index=slice(None), tile_cut={}):
+        """
+        Return the calibrated images of the filenames[index] inside the
+        tile_cut.
+        """
+        positions = np.atleast_1d(self.locate(filenames)[index])
+        (y0, y1), (x0, x1) = map(
+            lambda (d, size): tile_cut.get(d, [0, size]),
+            zip(['yc', 'xc'], self.shape))
+        result = np.empty((len(positions), y1 - y0, x1 - x0), np.float32)
+        ct, cy, cx = self.chunks
+        for t in np.unique(positions // ct):
+            rows = np.where(positions // ct == t)[0]
+            for y in range(y0 // cy, (y1 - 1) // cy + 1):
+                for x in range(x0 // cx, (x1 - 1) // cx + 1):
+                    chunk = np.load(self.get_filename(t, y, x),
+                                    mmap_mode='r')
+                    ys = slice(max(y0, y * cy), min(y1, (y + 1) * cy))
+                    xs = slice(max(x0, x * cx), min(x1, (x + 1) * cx))
+                    result[rows, ys.start - y0:ys.stop - y0,
+                           xs.start - x0:xs.stop - x0] = chunk[
+                        positions[rows] - t * ct,
+                        ys.start - y * cy:ys.stop - y * cy,
+                        xs.start - x * cx:xs.stop - x * cx]
+        return result
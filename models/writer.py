@@ -0,0 +1,62 @@
+import threading
+import Queue
+import logging
+import numpy as np
+from netcdf import netcdf as nc
+from helpers import netcdf_lock
+
+
+class ProductWriter(object):
+    """
+    Background thread that writes the chunks pushed into a bounded queue
+    to the variables of an output cache. The computation of the next chunk
+    overlaps with the writing of the previous ones, and the writer only
+    blocks the computation when the queue is full. The files are
+    synchronized once per batch of chunks, holding the netcdf_lock.
+    """
+
+    def __init__(self, output, queue_size=4, batch_size=8):
+        self.output = output
+        self.batch_size = batch_size
+        self.queue = Queue.Queue(queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def check(self):
+        if self.error:
+            raise self.error
+
+    def put(self, name, index, array):
+        self.check()
+        # The array is copied because the caller could reuse its buffer.
+        self.queue.put((name, index, np.array(array)))
+
+    def write(self, batch):
+        with netcdf_lock:
+            for name, index, array in batch:
+                getattr(self.output, 'ref_{:s}'.format(name))[index] = array
+            nc.sync(self.output.root)
+
+    def loop(self):
+        finished = False
+        while not finished:
+            batch = [self.queue.get()]
+            while (batch[-1] is not None and len(batch) < self.batch_size
+                   and not self.queue.empty()):
+                batch.append(self.queue.get())
+            finished = batch[-1] is None
+            batch = filter(lambda item: item is not None, batch)
+            try:
+                if batch and not self.error:
+                    self.write(batch)
+            except Exception, e:
+                logging.error("The product writer failed: {:s}".format(
+                    str(e)))
+                self.error = e
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
@@ -1,4 +1,13 @@
 import unittest
 from heliosat_test import *
+from core_test import *
+from reducers_test import *
+from stats_test import *
+from clearsky_test import *
+from precision_test import *
+from cache_test import *
+from catalog_test import *
+from profiler_test import *
+from lut_test import *
 # from performance_test import *
 unittest.main()
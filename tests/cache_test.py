@@ -0,0 +1,126 @@
+from __future__ import print_function
+import unittest
+from models.cache import Cache, LazyVariable, CalibrationCache
+from models.cache import EphemerisCache
+import numpy as np
+import glob
+import os
+
+
+class TestLazyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.files = sorted(glob.glob('data/goes13.*.BAND_01.nc'))[:4]
+        self.tile_cut = {
+            "xc": [20, 30],
+            "yc": [10, 15]
+        }
+
+    def test_hyperslab(self):
+        cache = Cache(self.files, tile_cut=self.tile_cut, read_only=True)
+        self.assertTrue(isinstance(cache.data, LazyVariable))
+        self.assertEquals(cache.data.shape, (4, 5, 10))
+        self.assertEquals(cache.data[1:3].shape, (2, 5, 10))
+        # Slicing shouldn't materialize the variable.
+        self.assertTrue(cache.materialized('data') is None)
+        self.assertTrue((np.asarray(cache.data)[1:3] ==
+                         cache.data[1:3]).all())
+        self.assertTrue((cache.data * 2 == np.asarray(cache.data) * 2).all())
+        cache.dump()
+
+    def test_memory_budget(self):
+        cache = Cache(self.files, tile_cut=self.tile_cut, read_only=True,
+                      memory_budget=1)
+        data = np.asarray(cache.data)
+        self.assertTrue(cache.materialized('data') is not None)
+        lat = np.asarray(cache.lat)
+        # The budget only allows the last used variable in memory.
+        self.assertTrue(cache.materialized('data') is None)
+        self.assertTrue(cache.materialized('lat') is not None)
+        self.assertTrue((np.asarray(cache.data) == data).all())
+        self.assertTrue(cache.materialized('lat') is None)
+        self.assertEquals(lat.shape[-2:], (5, 10))
+        cache.dump()
+
+
+class TestCalibrationCache(unittest.TestCase):
+
+    def setUp(self):
+        os.system('rm -rf calibration')
+        self.files = sorted(glob.glob('data/goes13.*.BAND_01.nc'))[:4]
+        self.calculated = []
+
+    def tearDown(self):
+        os.system('rm -rf calibration')
+
+    def calculate(self, missing):
+        self.calculated.extend(missing)
+        return map(lambda i: np.ones((1, 5, 10)) * i, missing)
+
+    def test_hits_and_misses(self):
+        cache = CalibrationCache('calibration', {'xc': [20, 30]})
+        first = cache.obtain(self.files[:3], self.calculate)
+        second = cache.obtain(self.files, self.calculate)
+        self.assertEquals(self.calculated, [0, 1, 2, 3])
+        self.assertEquals((cache.hits, cache.misses), (3, 4))
+        self.assertEquals(first.dtype, np.float32)
+        self.assertTrue((second[:3] == first).all())
+        other = CalibrationCache('calibration', {'xc': [0, 10]})
+        self.assertTrue(other.get_filename(self.files[0]) !=
+                        cache.get_filename(self.files[0]))
+
+    def test_eviction(self):
+        cache = CalibrationCache('calibration', max_bytes=1)
+        cache.obtain(self.files[:2], self.calculate)
+        self.assertEquals(len(glob.glob('calibration/*.npy')), 0)
+        cache.obtain(self.files[:2], self.calculate)
+        self.assertEquals(cache.misses, 4)
+
+    def test_concurrent_eviction(self):
+        cache = CalibrationCache('calibration')
+        cache.obtain(self.files[:1], self.calculate)
+
+        def calculate(missing):
+            # Another process evicts the stored image meanwhile.
+            map(os.remove, glob.glob('calibration/*.npy'))
+            return self.calculate(missing)
+        result = cache.obtain(self.files[:2], calculate)
+        self.assertEquals(self.calculated, [0, 1])
+        self.assertEquals(result[:, 0, 0].tolist(), [0., 1.])
+        self.assertEquals(len(glob.glob('calibration/*.npy')), 1)
+
+
+class TestEphemerisCache(unittest.TestCase):
+
+    def setUp(self):
+        os.system('rm -rf grid.ephemeris')
+        self.lat = np.zeros((5, 10))
+        self.lon = np.ones((5, 10))
+
+    def tearDown(self):
+        os.system('rm -rf grid.ephemeris')
+
+    def calculate(self, missing):
+        return map(lambda i: np.ones((5, 10)) * i, missing)
+
+    def test_key(self):
+        cache = EphemerisCache('grid.nc', self.lat, self.lon)
+        single = EphemerisCache('grid.nc', self.lat, self.lon, np.float32)
+        other = EphemerisCache('grid.nc', self.lat + 1, self.lon)
+        self.assertNotEquals(single.path, cache.path)
+        self.assertNotEquals(other.path, cache.path)
+        self.assertEquals(
+            EphemerisCache('grid.nc', self.lat, self.lon).path, cache.path)
+
+    def test_expiration(self):
+        cache = EphemerisCache('grid.nc', self.lat, self.lon)
+        cache.obtain(np.array([0, 1800]), self.calculate)
+        day = cache.SECONDS_PER_DAY
+        result = cache.obtain(np.array([40 * day]), self.calculate)
+        self.assertEquals(result.shape, (1, 5, 10))
+        self.assertEquals(glob.glob('{:s}/*.npy'.format(cache.path)),
+                          [cache.get_filename(40 * day)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+from __future__ import print_function
+import unittest
+from models import JobDescription
+from models.catalog import Catalog
+import os
+import glob
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        os.system('rm -rf catalog_test.db mock_data')
+        os.system('cp -rf data mock_data')
+        self.pattern = 'mock_data/goes13.*.BAND_01.nc'
+
+    def tearDown(self):
+        os.system('rm -rf catalog_test.db mock_data')
+
+    def test_select(self):
+        catalog = Catalog('catalog_test.db')
+        files = glob.glob(self.pattern)
+        self.assertEquals(catalog.update(self.pattern), len(files))
+        self.assertEquals(catalog.update(self.pattern), 0)
+        self.assertEquals(catalog.select(self.pattern),
+                          sorted(JobDescription.filter_data(self.pattern)))
+        os.remove(files[0])
+        catalog.update(self.pattern)
+        self.assertEquals(len(catalog.paths()), len(files) - 1)
+        self.assertEquals(catalog.select('other/*.nc'), [])
+        catalog.close()
+
+    def test_unchanged_directories(self):
+        catalog = Catalog('catalog_test.db')
+        files = sorted(glob.glob(self.pattern))
+        os.rename(files[-1], 'catalog_test.nc')
+        os.utime('mock_data', (1e9, 1e9))
+        self.assertEquals(catalog.update(self.pattern), len(files) - 1)
+        # A directory that wasn't modified since the last update isn't
+        # listed again.
+        os.rename('catalog_test.nc', files[-1])
+        os.utime('mock_data', (1e9, 1e9))
+        self.assertEquals(catalog.update(self.pattern), 0)
+        # The downloaded files can be added directly.
+        self.assertEquals(catalog.add(files), 1)
+        self.assertEquals(catalog.add(files), 0)
+        os.remove(files[0])
+        self.assertEquals(catalog.update(self.pattern), 0)
+        self.assertEquals(len(catalog.paths()), len(files) - 1)
+        os.system('rm -rf mock_data')
+        catalog.update(self.pattern)
+        self.assertEquals(catalog.paths(), [])
+        catalog.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+from __future__ import print_function
+import unittest
+from models import clearsky
+from models.cpu import CPUStrategy
+from datetime import datetime
+import numpy as np
+
+
+class TestClearSky(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        shape = (50, 40, 60)
+        self.excentricity = 1 + random.rand(shape[0], 1, 1) * 0.03
+        self.solarangle = random.rand(*shape) * 100
+        self.solarelevation = CPUStrategy.getelevation(self.solarangle)
+        self.linke = 2 + random.rand(*shape) * 4
+        self.dem = random.rand(1, *shape[1:]) * 3000
+        self.satellitalelevation = 20 + random.rand(1, *shape[1:]) * 40
+        self.satellital_opticalpath = CPUStrategy.getopticalpath(
+            CPUStrategy.getcorrectedelevation(self.satellitalelevation),
+            self.dem, 8434.5)
+        self.satellital_opticaldepth = CPUStrategy.getopticaldepth(
+            self.satellital_opticalpath)
+        self.strategy = CPUStrategy.__new__(CPUStrategy)
+        self.strategy.excentricity = self.excentricity
+        self.strategy.solarangle = self.solarangle
+        self.strategy.solarelevation = self.solarelevation
+
+    def args(self):
+        return (self.linke, self.satellitalelevation,
+                self.satellital_opticalpath, self.satellital_opticaldepth)
+
+    def test_esra(self):
+        static = type('Static', (object,), {'dem': self.dem})
+        begin = datetime.now()
+        expected = self.strategy.calculate_clearsky(static, *self.args())
+        direct = (datetime.now() - begin).total_seconds()
+        begin = datetime.now()
+        result = clearsky.esra(self.excentricity, self.solarangle,
+                               self.solarelevation, self.linke, self.dem,
+                               *self.args()[1:])
+        fused = (datetime.now() - begin).total_seconds()
+        for r, e in zip(result, expected):
+            self.assertTrue(np.allclose(r, e))
+        print("Clear sky: direct {:.3f}s, fused {:.3f}s ({:s})".format(
+            direct, fused, 'numexpr' if clearsky.numexpr else 'numpy'))
+
+
+if __name__ == '__main__':
+    unittest.main()
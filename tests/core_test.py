@@ -0,0 +1,171 @@
+from __future__ import print_function
+import unittest
+from models.core import WorkerPool, mp_map, ProcessingStrategy, SHM_PATH
+from models.cpu import CPUStrategy
+from models.cache import memoize
+from datetime import datetime
+import numpy as np
+import tempfile
+import glob
+import gc
+
+
+def squares(x):
+    return x, np.arange(x, dtype=np.float32) ** 2
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_map(self):
+        with WorkerPool(processes=3, chunksize=2) as pool:
+            results = pool.map(squares, range(10))
+            # The pool should be reusable after a map.
+            again = pool.map(squares, [4])
+        self.assertEquals(map(lambda r: r[0], results), range(10))
+        for x, array in results:
+            self.assertEquals(array.dtype, np.float32)
+            self.assertTrue((array == np.arange(x) ** 2).all())
+        self.assertTrue((again[0][1] == results[4][1]).all())
+
+    def test_release(self):
+        shared = lambda: set(glob.glob('{:s}/*.shared'.format(
+            SHM_PATH or tempfile.gettempdir())))
+        before = shared()
+        with WorkerPool(processes=2) as pool:
+            results = pool.imap(squares, range(1, 10))
+            # The consumer stops after the first result.
+            next(results)
+        self.assertEquals(shared() - before, set())
+
+    def test_mp_map(self):
+        results = mp_map(squares, [3, 1], processes=1)
+        self.assertEquals(map(lambda r: r[0], results), [3, 1])
+
+
+class Algorithm(object):
+    IMAGE_PER_HOUR = 2
+
+
+class Loader(object):
+
+    def __init__(self, times):
+        self.time = times
+
+
+class TestTimeDecoding(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.times = random.randint(1262304000, 1451606400,
+                                    (20000, 1)).astype(float)
+        self.strategy = CPUStrategy(Algorithm(), Loader(self.times))
+
+    def legacy(self, times):
+        # Previous (datetime based) decoding of the ProcessingStrategy.
+        int_to_dt = lambda t: datetime.utcfromtimestamp(int(t))
+        to_julianday = lambda time: int_to_dt(time).timetuple().tm_yday
+        days_of_year = lambda time: to_julianday(
+            (datetime(int_to_dt(time).year, 12, 31)).timetuple()[7])
+        months = np.array(map(lambda t: int_to_dt(t).month,
+                              times)).reshape(times.shape)
+        total_days = np.array(map(days_of_year, times)).reshape(times.shape)
+        julian_day = np.array(map(to_julianday, times)).reshape(times.shape)
+        gamma = self.strategy.getdailyangle(julian_day, total_days)
+        int_to_decimalhour = (lambda time: int_to_dt(time).hour +
+                              int_to_dt(time).minute/60.0 +
+                              int_to_dt(time).second/3600.0)
+        decimalhour = np.array(map(int_to_decimalhour,
+                                   times)).reshape(times.shape)
+        return months, gamma, decimalhour
+
+    def vectorized(self):
+        strategy = CPUStrategy(Algorithm(), Loader(self.times))
+        return strategy.months, strategy.gamma, strategy.decimalhour
+
+    def test_decoding(self):
+        begin = datetime.now()
+        expected = self.legacy(self.strategy.times)
+        legacy = (datetime.now() - begin).total_seconds()
+        begin = datetime.now()
+        result = self.vectorized()
+        vectorized = (datetime.now() - begin).total_seconds()
+        for r, e in zip(result, expected):
+            self.assertEquals(r.shape, e.shape)
+            self.assertTrue((r == e).all())
+        print("Decoding {:d} timestamps: {:.3f}s (legacy {:.3f}s, "
+              "{:.1f}x)".format(self.times.size, vectorized, legacy,
+                                legacy / vectorized))
+
+
+class Static(object):
+
+    def __init__(self):
+        self.linke = np.arange(12 * 5 * 10.).reshape((1, 12, 5, 10))
+
+
+class TestLinke(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.times = random.randint(1262304000, 1451606400,
+                                    (200, 1)).astype(float)
+        self.strategy = CPUStrategy(Algorithm(), Loader(self.times))
+        self.static = Static()
+
+    def legacy(self, index):
+        # Previous per image copy of the monthly Linke turbidity maps.
+        return np.vstack([map(lambda m: self.static.linke[0, m[0][0] - 1, :],
+                              self.strategy.months[index].tolist())])
+
+    def test_getchunks(self):
+        self.times.sort(axis=0)
+        strategy = CPUStrategy(Algorithm(), Loader(self.times))
+        months = np.ravel(strategy.months)
+        chunks = strategy.getchunks(range(len(self.times)), 5)
+        self.assertEquals(sum(map(lambda c: c.stop - c.start, chunks)),
+                          len(self.times))
+        for index in chunks:
+            self.assertTrue(index.stop - index.start <= 5)
+            self.assertEquals(len(set(months[index])), 1)
+        # A chunk only ends before its size at a change of month.
+        for previous, index in zip(chunks, chunks[1:]):
+            self.assertTrue(previous.stop - previous.start == 5 or
+                            months[previous.start] != months[index.start])
+
+    def test_getlinke(self):
+        for index in self.strategy.getchunks(range(len(self.times)), 200):
+            expected = self.legacy(index)
+            linke = self.strategy.getlinke(self.static, index)
+            self.assertEquals(linke.shape, (1, 5, 10))
+            self.assertTrue((np.broadcast_arrays(linke, expected)[0] ==
+                             expected).all())
+
+
+class Squares(object):
+    pass
+
+
+class TestMemoize(unittest.TestCase):
+
+    def test_lru(self):
+        memoized = memoize(maxsize=2)(lambda instance, x: np.ones(10) * x ** 2)
+        squares = Squares()
+        map(lambda x: memoized(squares, x), [1, 2, 1, 3, 1, 2])
+        # The 2 is evicted by the 3, and the 1 is kept since it was used.
+        self.assertEquals((memoized.hits, memoized.misses), (2, 4))
+
+    def test_release(self):
+        memoized = ProcessingStrategy.__dict__['months'].fget
+        strategy = CPUStrategy(Algorithm(), Loader(np.zeros((3, 1))))
+        strategy.months
+        strategy.months
+        self.assertTrue(memoized.hits >= 1)
+        self.assertTrue(strategy in memoized.memoized)
+        count = memoized.info()['instances']
+        del strategy
+        gc.collect()
+        self.assertEquals(memoized.info()['instances'], count - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,12 @@
 from __future__ import print_function
 import unittest
 from netcdf import netcdf as nc
-from models import JobDescription
+from models import JobDescription, TiledJobDescription
 from models.cache import Cache, StaticCache
+from models.store import ImageStore
+from contextlib import closing
+import netCDF4
+import numpy as np
 import os
 import glob
 
@@ -10,7 +14,7 @@ import glob
 class TestHeliosat(unittest.TestCase):
 
     def setUp(self):
-        os.system('rm -rf static.nc product')
+        os.system('rm -rf static.nc static.ephemeris product')
         os.system('cp -rf data mock_data')
         self.files = glob.glob('mock_data/goes13.*.BAND_01.nc')[:-1]
         self.tile_cut = {
@@ -64,14 +68,28 @@ class TestHeliosat(unittest.TestCase):
         job = JobDescription(**config)
         self.files = job.filter_data(self.files)
         intern_elapsed, output = job.run()
-        shape = self.verify_output(self.files, output, config)
-        image_ratio = (15. * 12. * 2. / shape[0])
-        scale_shapes = (2260. / shape[1]) * (4360. / shape[2]) * (image_ratio)
-        cores = 24. * 7.
-        intern_estimated = intern_elapsed * (scale_shapes / cores) / 3600.
-        print("Scaling intern time to {:.2f} hours.".format(intern_estimated))
-        print("Needed efficiency achieved: {:.2f}%".format(
-            0.5 / intern_estimated * 100.))
+        self.verify_output(self.files, output, config)
+
+    def test_product(self):
+        os.system('rm -rf products/estimated')
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': self.files,
+            'product': 'products/estimated',
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+        }
+        job = JobDescription(**config)
+        self.files = job.filter_data(self.files)
+        intern_elapsed, output = job.run()
+        self.verify_output(self.files, output, config)
+        product = self.translate_file('products/estimated', self.files[0])
+        with closing(netCDF4.Dataset(product)) as root:
+            var = root.variables['globalradiation']
+            self.assertEquals(var.chunking(), [1, 86, 100])
+            self.assertTrue(var.filters()['zlib'])
+        os.system('rm -rf products/estimated')
 
     def test_with_loaded_files(self):
         files = JobDescription.filter_data(self.files)
@@ -85,14 +103,192 @@ class TestHeliosat(unittest.TestCase):
         }
         job = JobDescription(**config)
         intern_elapsed, output = job.run()
-        shape = self.verify_output(files, output, config)
-        image_ratio = (15. * 12. * 2. / shape[0])
-        scale_shapes = (2260. / shape[1]) * (4360. / shape[2]) * (image_ratio)
-        cores = 24. * 7.
-        intern_estimated = intern_elapsed * (scale_shapes / cores) / 3600.
-        print("Scaling intern time to {:.2f} hours.".format(intern_estimated))
-        print("Needed efficiency achieved: {:.2f}%".format(
-            0.5 / intern_estimated * 100.))
+        self.verify_output(files, output, config)
+
+    def test_streaming(self):
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': self.files,
+            'product': None,
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+            'chunk_size': 5,
+        }
+        job = JobDescription(**config)
+        self.files = job.filter_data(self.files)
+        intern_elapsed, output = job.run()
+        self.verify_output(self.files, output, config)
+        self.assertTrue('ground albedo' in output.profile)
+        self.assertTrue(output.profile['cloud index']['calls'] > 1)
+
+    def test_fused(self):
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': self.files,
+            'product': None,
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+            'fused': True,
+        }
+        job = JobDescription(**config)
+        self.files = job.filter_data(self.files)
+        intern_elapsed, output = job.run()
+        self.verify_output(self.files, output, config)
+
+    def test_lut(self):
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': self.files,
+            'product': None,
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+            'lut': True,
+        }
+        job = JobDescription(**config)
+        self.files = job.filter_data(self.files)
+        intern_elapsed, output = job.run()
+        self.verify_output(self.files, output, config)
+
+    def test_prefetch(self):
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': self.files,
+            'product': None,
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+            'chunk_size': 5,
+            'prefetch': 2,
+        }
+        job = JobDescription(**config)
+        self.files = job.filter_data(self.files)
+        intern_elapsed, output = job.run()
+        self.verify_output(self.files, output, config)
+        self.assertTrue(output.profile['prefetch stall']['calls'] >
+                        output.profile['cloud index']['calls'])
+
+    def test_store(self):
+        os.system('rm -rf store')
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': self.files,
+            'product': None,
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+            'store': 'store',
+        }
+        job = JobDescription(**config)
+        self.files = job.filter_data(self.files)
+        self.assertEquals(len(ImageStore('store').names), len(self.files))
+        intern_elapsed, output = job.run()
+        self.verify_output(self.files, output, config)
+        os.system('rm -rf store')
+
+    def test_static_store(self):
+        os.system('rm -rf static_store')
+        files = JobDescription.filter_data(self.files)
+        StaticCache('static.nc', files, self.tile_cut,
+                    store='static_store').dump()
+        stored = glob.glob('static_store/*.nc')
+        self.assertEquals(len(stored), 1)
+        self.assertEquals(os.path.basename(stored[0]),
+                          '{:s}.nc'.format(StaticCache.grid_key(files[0])))
+        os.rename('static.nc', 'constructed.nc')
+        static = StaticCache('static.nc', files, self.tile_cut,
+                             store='static_store')
+        constructed = StaticCache('constructed.nc', files, self.tile_cut)
+        self.assertTrue((static.linke == constructed.linke).all())
+        self.assertTrue((static.dem == constructed.dem).all())
+        static.dump()
+        constructed.dump()
+        os.system('rm -rf static_store constructed.nc')
+
+    def test_ephemeris(self):
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': self.files,
+            'product': None,
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+            'ephemeris': True,
+        }
+        files = JobDescription.filter_data(self.files)
+        JobDescription(**config).run()
+        stored = glob.glob('static.ephemeris/*/*.npy')
+        self.assertEquals(len(stored), len(files))
+        intern_elapsed, output = JobDescription(**config).run()
+        self.verify_output(files, output, config)
+
+    def test_tiled(self):
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': self.files,
+            'product': None,
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+        }
+        job = TiledJobDescription(tile_shape={'yc': 3, 'xc': 4}, **config)
+        self.assertEquals(len(job.tiles), 6)
+        self.files = job.filter_data(self.files)
+        intern_elapsed, output = job.run()
+        self.verify_output(self.files, output, config)
+        # The tiles share the percentile threshold of the whole cut, so the
+        # stitched products match the ones estimated without tiles.
+        intern_elapsed, untiled = JobDescription(**config).run()
+        self.verify_output(self.files, untiled, config)
+        valid = untiled.globalradiation >= 0
+        tiled, untiled = (output.globalradiation[valid],
+                          untiled.globalradiation[valid])
+        self.assertTrue((np.abs(tiled - untiled) <
+                         untiled.max() * 0.01).all())
+        # The streaming job uses the same sketch of the percentile.
+        intern_elapsed, streamed = JobDescription(
+            **dict(config, chunk_size=5)).run()
+        self.assertTrue(np.allclose(tiled, streamed.globalradiation[valid]))
+
+    def test_incremental(self):
+        os.system('rm -rf products/incremental')
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': sorted(self.files),
+            'product': 'products/incremental',
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+            'incremental': True,
+        }
+        files = JobDescription.filter_data(config['data'])
+        half = len(files) / 2
+        job = JobDescription(**dict(config, data=files[:half]))
+        self.assertEquals(len(job.config['filenames']), half)
+        job.run()
+        state = 'products/incremental/groundalbedo.xc20-30.yc10-15.npz'
+        self.assertTrue(os.path.exists(state))
+        # The product of an image that isn't recorded as estimated (like
+        # the ones of a failed run) is estimated again.
+        estimated = 'products/incremental/estimated.xc20-30.yc10-15.txt'
+        with open(estimated) as f:
+            names = f.read().split()
+        self.assertEquals(len(names), half)
+        with open(estimated, 'w') as f:
+            f.write('\n'.join(names[:-1]))
+        job = JobDescription(**config)
+        self.assertEquals(len(job.config['filenames']), len(files) - half + 1)
+        job.run()
+        produced = glob.glob('products/incremental/goes13.*.BAND_01.nc')
+        self.assertEquals(len(produced), len(files))
+        self.assertEquals(JobDescription(**config).run(), (0, None))
+        # Removing the state estimates the whole window again to rebuild it.
+        os.remove(state)
+        job = JobDescription(**config)
+        self.assertEquals(len(job.config['filenames']), len(files))
+        os.system('rm -rf products/incremental')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,76 @@
+from __future__ import print_function
+import unittest
+from models.cpu import CPUStrategy
+from models import lut
+from datetime import datetime
+import numpy as np
+
+
+class Algorithm(object):
+    IMAGE_PER_HOUR = 2
+    config = {'lut': True}
+
+
+class Loader(object):
+    time = np.zeros((1, 1))
+
+
+class TestLookUpTables(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.elevation = random.uniform(-90, 90, (10, 100, 100))
+        self.strategy = CPUStrategy(Algorithm(), Loader())
+
+    def elapsed(self, function, *args):
+        begin = datetime.now()
+        result = function(*args)
+        return result, (datetime.now() - begin).total_seconds()
+
+    def test_tables(self):
+        for name, table in lut.tables().items():
+            x = np.linspace(table.lower, table.upper, 100003)
+            error = np.abs(table(x) - table.function(x)).max()
+            self.assertTrue(error <= table.tolerance * 1.5, name)
+
+    def test_non_finite(self):
+        values = np.array([np.nan, np.inf, -np.inf, 45.], np.float32)
+        for name, table in lut.tables().items():
+            with np.errstate(invalid='ignore', over='ignore',
+                             divide='ignore'):
+                expected = table.function(values)
+                result = table(values)
+            self.assertEquals(result.dtype, np.float32, name)
+            self.assertTrue(np.isnan(result[0]), name)
+            self.assertTrue((np.isnan(result) == np.isnan(expected)).all(),
+                            name)
+            finite = np.isfinite(expected)
+            self.assertTrue(np.allclose(result[finite], expected[finite],
+                                        atol=1e-3), name)
+
+    def test_strategy(self):
+        elevation = self.elevation.astype(np.float32)
+        terrain = np.zeros(elevation.shape[1:], np.float32)
+        formulas = [CPUStrategy.getcorrectedelevation,
+                    CPUStrategy.geteffectivealbedo]
+        tables = [self.strategy.getcorrectedelevation,
+                  self.strategy.geteffectivealbedo]
+        for formula, table in zip(formulas, tables):
+            expected, formula_time = self.elapsed(formula, elevation)
+            result, table_time = self.elapsed(table, elevation)
+            self.assertEquals(result.dtype, np.float32)
+            self.assertTrue(np.allclose(result, expected, atol=1e-3))
+            print('{:s}: {:.3f}s (formula {:.3f}s)'.format(
+                formula.__name__, table_time, formula_time))
+        corrected = CPUStrategy.getcorrectedelevation(elevation)
+        path = CPUStrategy.getopticalpath(corrected.copy(), terrain, 8434.5)
+        self.assertTrue(np.allclose(
+            self.strategy.getopticalpath(corrected, terrain, 8434.5), path,
+            rtol=1e-4))
+        self.assertTrue(np.allclose(self.strategy.getopticaldepth(path),
+                                    CPUStrategy.getopticaldepth(path),
+                                    rtol=1e-4))
+
+
+if __name__ == '__main__':
+    unittest.main()
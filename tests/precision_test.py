@@ -0,0 +1,65 @@
+from __future__ import print_function
+import unittest
+from netcdf import netcdf as nc
+from models import JobDescription
+import numpy as np
+import os
+import glob
+
+
+class TestPrecision(unittest.TestCase):
+
+    def setUp(self):
+        os.system('rm -rf static.nc product')
+        os.system('cp -rf data mock_data')
+        self.files = glob.glob('mock_data/goes13.*.BAND_01.nc')[:-1]
+        self.tile_cut = {
+            "xc": [20, 30],
+            "yc": [10, 15]
+        }
+
+    def tearDown(self):
+        os.system('rm -rf mock_data')
+
+    def reference(self, files):
+        tested = map(lambda f: 'tests/products/estimated/{:s}'.format(
+            f.split('/')[-1]), files)
+        with nc.loader(tested, self.tile_cut) as old:
+            return nc.getvar(old, 'globalradiation')[:]
+
+    def deviation(self, precision):
+        config = {
+            'algorithm': 'heliosat',
+            'static_file': 'static.nc',
+            'data': self.files,
+            'product': None,
+            'tile_cut': self.tile_cut,
+            'hard': 'cpu',
+            'precision': precision,
+        }
+        files = JobDescription.filter_data(self.files)
+        elapsed, output = JobDescription(**config).run()
+        valid = self.reference(files)
+        calculated = output.globalradiation
+        gtz = calculated >= 0
+        diff = np.abs(calculated[gtz] - valid[gtz])
+        print("{:s}: {:.2f}s, max deviation {:.4f} W/m2 ({:.4f}% of the "
+              "maximum), mean deviation {:.4f} W/m2".format(
+                  precision, elapsed, diff.max(),
+                  diff.max() / valid.max() * 100., diff.mean()))
+        return calculated, diff.max(), valid.max()
+
+    def test_float32(self):
+        calculated, max_deviation, max_valid = self.deviation('float32')
+        self.assertEquals(calculated.dtype, np.float32)
+        # It allow a 1% of the maximum value as the maximum error threshold.
+        self.assertTrue(max_deviation < max_valid * 0.01)
+
+    def test_float64(self):
+        calculated, max_deviation, max_valid = self.deviation('float64')
+        self.assertEquals(calculated.dtype, np.float64)
+        self.assertTrue(max_deviation < max_valid * 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
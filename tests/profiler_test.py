@@ -0,0 +1,53 @@
+from __future__ import print_function
+import unittest
+from models.profiler import Profiler
+import numpy as np
+import json
+import os
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_stages(self):
+        profiler = Profiler()
+        for i in range(2):
+            with profiler.stage('allocation') as stage:
+                stage.produced(np.ones((100, 100)), np.ones(10, np.int8))
+        with profiler.stage('nothing'):
+            pass
+        profile = profiler.to_dict()
+        self.assertEquals(profile.keys(), ['allocation', 'nothing'])
+        self.assertEquals(profile['allocation']['calls'], 2)
+        self.assertEquals(profile['allocation']['bytes'], 2 * 80010)
+        self.assertTrue(profile['allocation']['wall'] >= 0)
+        self.assertTrue(profile['nothing']['peak'] >= 0)
+        merged = Profiler().merge(profile).merge(profile)
+        self.assertEquals(merged.to_dict()['allocation']['calls'], 4)
+
+    def test_peak(self):
+        profiler = Profiler()
+        size = 2 ** 27
+        with profiler.stage('transient'):
+            transient = np.ones(size / 8)
+            del transient
+        with profiler.stage('after'):
+            pass
+        profile = profiler.to_dict()
+        # The peak is the growth during the stage, not the one of the
+        # process.
+        self.assertTrue(profile['transient']['peak'] >= size * 0.9)
+        self.assertTrue(profile['transient']['allocated'] < size * 0.1)
+        self.assertTrue(profile['after']['peak'] < size * 0.1)
+
+    def test_json(self):
+        profiler = Profiler()
+        with profiler.stage('stage'):
+            pass
+        profiler.to_json('profile.json')
+        with open('profile.json') as f:
+            self.assertEquals(json.load(f)['stage']['calls'], 1)
+        os.remove('profile.json')
+
+
+if __name__ == '__main__':
+    unittest.main()
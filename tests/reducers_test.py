@@ -0,0 +1,85 @@
+from __future__ import print_function
+import unittest
+from models import reducers
+from models import stats
+import numpy as np
+import os
+
+
+class TestReducers(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.albedo = np.round(random.rand(40, 5, 10), 2)
+        self.mask = random.rand(40, 5, 10) < 0.3
+
+    def secondmin(self, albedo):
+        # Previous implementation of CPUStrategy.getsecondmin.
+        min1_albedo = np.ma.masked_array(albedo,
+                                         albedo == np.amin(albedo, axis=0))
+        return np.amin(min1_albedo, axis=0)
+
+    def test_two_smallest(self):
+        tracker = reducers.TwoSmallest()
+        for image, mask in zip(self.albedo, self.mask):
+            tracker.update(image, mask)
+        expected = self.secondmin(np.ma.masked_array(self.albedo, self.mask))
+        result = tracker.secondmin()
+        self.assertTrue((result.mask == np.ma.getmaskarray(expected)).all())
+        self.assertTrue((result == expected).all())
+
+    def test_percentile_sketch(self):
+        sketch = reducers.PercentileSketch(resolution=1e-3)
+        map(sketch.update, self.albedo)
+        for per in [0, 5, 50, 99]:
+            expected = stats.scoreatpercentile(self.albedo, per)
+            error = abs(sketch.percentile(per) - expected)
+            self.assertTrue(error <= 5e-4 + 1e-9)
+
+    def test_percentile_sketch_merge(self):
+        first = reducers.PercentileSketch().update(self.albedo[:20])
+        second = reducers.PercentileSketch().update(self.albedo[20:])
+        sketch = reducers.PercentileSketch().update(self.albedo)
+        self.assertEquals(first.merge(second).percentile(5),
+                          sketch.percentile(5))
+
+    def test_ground_albedo_window(self):
+        # 40 images, 4 by day, over 10 days.
+        times = np.arange(40) / 4 * 86400. + np.arange(40) % 4 * 1800.
+        nothing = np.zeros(self.albedo.shape, dtype=bool)
+        state = reducers.GroundAlbedoState(days=4)
+        for i in range(0, 40, 8):
+            batch = slice(i, i + 8)
+            state.update(times[batch], self.albedo[batch], nothing[batch],
+                         self.mask[batch])
+        self.assertEquals(sorted(state.summaries.keys()), range(5, 10))
+        self.assertEquals(len(state.times), 20)
+        window = slice(20, 40)
+        expected = self.secondmin(np.ma.masked_array(self.albedo[window],
+                                                     self.mask[window]))
+        self.assertTrue((state.minimum() == expected).all())
+        self.assertEquals(state.percentile(50),
+                          reducers.PercentileSketch().update(
+                              self.albedo[window]).percentile(50))
+        state.save('groundalbedo.npz')
+        loaded = reducers.GroundAlbedoState.load('groundalbedo.npz')
+        self.assertEquals(loaded.days, 4)
+        self.assertTrue((loaded.reference(0.5) ==
+                         state.reference(0.5)).all())
+        os.remove('groundalbedo.npz')
+
+    def test_empty_ground_albedo_state(self):
+        # A first run without noon images leaves the state empty.
+        state = reducers.GroundAlbedoState(days=4)
+        self.assertEquals(state.sketch().size, 0)
+        self.assertRaises(ValueError, state.percentile, 5)
+        self.assertRaises(ValueError, state.minimum)
+        state.save('groundalbedo.npz')
+        loaded = reducers.GroundAlbedoState.load('groundalbedo.npz')
+        self.assertEquals((loaded.days, loaded.summaries), (4, {}))
+        self.assertEquals(len(loaded.times), 0)
+        os.remove('groundalbedo.npz')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+from __future__ import print_function
+import unittest
+from models import stats
+from datetime import datetime
+import numpy as np
+
+
+class TestSelectPercentile(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.albedo = random.rand(60, 20, 30)
+        self.mask = random.rand(60, 20, 30) < 0.4
+
+    def test_global(self):
+        for per in [0, 5, 50, 100]:
+            for method in ['fraction', 'lower', 'higher']:
+                expected = stats.scoreatpercentile(
+                    self.albedo, per, interpolation_method=method)
+                result = stats.selectpercentile(
+                    self.albedo, per, interpolation_method=method)
+                self.assertAlmostEquals(result, expected)
+
+    def test_masked_global(self):
+        # The vendored scoreatpercentile ignores the mask.
+        m_albedo = np.ma.masked_array(self.albedo, self.mask)
+        expected = stats.scoreatpercentile(m_albedo, 5)
+        result = stats.selectpercentile(np.ma.getdata(m_albedo), 5)
+        self.assertEquals(result, expected)
+
+    def test_pixel(self):
+        expected = stats.scoreatpercentile(self.albedo, 5, axis=0)
+        result = stats.selectpercentile(self.albedo, 5, axis=0)
+        self.assertTrue(np.allclose(result, expected))
+
+    def test_masked_pixel(self):
+        self.mask[:, 0, 0] = True
+        m_albedo = np.ma.masked_array(self.albedo, self.mask)
+        result = stats.selectpercentile(m_albedo, 5, axis=0)
+        self.assertTrue(result.mask[0, 0])
+        for y, x in [(0, 1), (10, 15), (19, 29)]:
+            expected = stats.scoreatpercentile(m_albedo[:, y, x].compressed(),
+                                               5)
+            self.assertAlmostEquals(result[y, x], expected)
+
+    def elapsed(self, function):
+        begin = datetime.now()
+        function()
+        return (datetime.now() - begin).total_seconds()
+
+    def test_benchmark(self):
+        albedo = np.random.RandomState(1).rand(200, 100, 100)
+        elapsed = self.elapsed
+        sort = elapsed(lambda: stats.scoreatpercentile(albedo, 5))
+        select = elapsed(lambda: stats.selectpercentile(albedo, 5))
+        print("scoreatpercentile: {:.3f}s, selectpercentile: {:.3f}s "
+              "({:.1f}x)".format(sort, select, sort / select))
+        sort = elapsed(lambda: stats.scoreatpercentile(albedo, 5, axis=0))
+        select = elapsed(lambda: stats.selectpercentile(albedo, 5, axis=0))
+        print("by pixel - scoreatpercentile: {:.3f}s, selectpercentile: "
+              "{:.3f}s ({:.1f}x)".format(sort, select, sort / select))
+
+
+if __name__ == '__main__':
+    unittest.main()